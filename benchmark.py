@@ -0,0 +1,861 @@
+"""Wallhaven 爬虫离线基准测试
+
+启动一个本地的 wallhaven.cc / w.wallhaven.cc 替身服务器，提供列表页、详情页、JSON API 和合成图片，
+可配置延迟、带宽、429 限流和连接中断。每个场景在独立的子进程中运行爬虫，输出页/秒、MB/秒、
+p50/p99 延迟和峰值内存，可保存为基线并在之后的运行中作为回归检查。
+
+    python benchmark.py                          # 运行全部标准场景
+    python benchmark.py --quick --scenario download --scenario stream
+    python benchmark.py --save baseline.json     # 保存基线
+    python benchmark.py --compare baseline.json  # 与基线比较，有回归时退出码为 1
+    python benchmark.py --memory                 # 比较 1 万 / 10 万 / 100 万条壁纸记录的内存占用
+    python benchmark.py --scenario startup       # 测量导入耗时 (python -X importtime) 和短时运行的启动耗时
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import subprocess
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from rich.console import Console
+from rich.table import Table
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import wallhaven_spider
+from wallhaven_spider import WallhavenSpider, Wallpaper, Metrics, DEFAULT_CONFIG, format_size
+
+# 每个列表页的壁纸数量，与 Wallhaven 默认一致
+PER_PAGE = 24
+
+# 内存基准测试的记录数量
+MEMORY_COUNTS = [10_000, 100_000, 1_000_000]
+MEMORY_RESOLUTIONS = [(1920, 1080), (2560, 1440), (3840, 2160), (7680, 4320)]
+
+# 标准场景：pages 为列表页数，server 为替身服务器的故障注入参数，config 为爬虫配置覆盖
+SCENARIOS = {
+    'listing': {'description': "列表页 (HTML)", 'pages': 100, 'download': False, 'page_worker_sweep': True},
+    'listing-api': {'description': "列表页 (JSON API)", 'pages': 100, 'download': False, 'config': {'listing_backend': 'api'},
+                    'page_worker_sweep': True},
+    'download': {'description': "列表页 + 下载 (线程池)", 'pages': 100},
+    'download-async': {'description': "列表页 + 下载 (asyncio)", 'pages': 100, 'config': {'io_backend': 'async'}, 'requires': 'aiohttp'},
+    'stream': {'description': "流式下载", 'pages': 100, 'config': {'stream_downloads': True}},
+    'details': {'description': "详情页", 'details': 240, 'download': False},
+    'watch': {'description': "同步模式：首次同步 1 页，之后 10 轮每轮新增 10 张", 'watch': {'cycles': 10, 'uploads': 10},
+              'server': {'uploaded': 2400}},
+    'enrich': {'description': "列表页 + 详情页补全大小、标签和颜色", 'pages': 10, 'download': False,
+               'config': {'detail_fields': ['file_size', 'tags', 'colors', 'purity']}},
+    'throttled': {'description': "5% 请求返回 429", 'pages': 20, 'server': {'throttle_rate': 0.05}},
+    'flaky': {'description': "5% 下载中途断开", 'pages': 20, 'server': {'drop_rate': 0.05}},
+    'mismatch': {'description': "25% 列表页扩展名错误", 'pages': 20, 'server': {'mismatch_rate': 0.25}},
+    'mixed-sizes': {'description': "每 10 张中有 1 张 16 倍大小的 8K 壁纸，总带宽 20 MB/秒", 'pages': 20,
+                    'server': {'large_every': 10}, 'config': {'bandwidth_limit': 20 * 1024}},
+    # 超时只限制连接和每次读取，单个文件在带宽限制下传输超过 3 秒也不应失败，两种后端结果应一致
+    'capped': {'description': "总带宽 10 MB/秒，超时 3 秒，不重试 (线程池)", 'pages': 20,
+               'server': {'large_every': 10}, 'config': {'bandwidth_limit': 10 * 1024, 'timeout': 3, 'max_retries': 0}},
+    'capped-async': {'description': "总带宽 10 MB/秒，超时 3 秒，不重试 (asyncio)", 'pages': 20, 'requires': 'aiohttp',
+                     'server': {'large_every': 10}, 'config': {'bandwidth_limit': 10 * 1024, 'timeout': 3, 'max_retries': 0, 'io_backend': 'async'}},
+    'parser': {'description': "列表页解析器：lxml 与 BeautifulSoup 各解析同一页 200 次", 'pages': 200, 'download': False, 'parser': True},
+    'parity': {'description': "HTML 与 JSON API 列表结果一致性，不一致时计为失败", 'pages': 20, 'download': False, 'parity': True},
+    'startup': {'description': "启动耗时：新进程导入模块，以纯文本模式获取 1 页列表后退出", 'startup': True},
+}
+
+# 启动耗时场景重复运行的次数，第一次用于预热，其余取最小值以减少噪声
+STARTUP_RUNS = 5
+# 模拟定时任务的一次短时运行，输出失败数和被加载的重量级模块
+STARTUP_SCRIPT = '''
+import sys, json
+import wallhaven_spider
+spider = wallhaven_spider.WallhavenSpider(sys.argv[2], console=wallhaven_spider.PlainConsole(quiet=True))
+spider.base_url = spider.image_base_url = sys.argv[1]
+spider.api_url = sys.argv[1] + '/api/v1'
+stats = spider.run_job('latest', [1], download=False)
+print(json.dumps({'failed': stats['failed'] + stats.get('failed_pages', 0),
+                  'loaded': [name for name in ('rich', 'bs4', 'aiohttp', 'asyncio') if name in sys.modules]}))
+'''
+
+# HTML 与 JSON API 两种列表数据来源应当一致的字段
+PARITY_FIELDS = ['url', 'thumb_url', 'download_url', 'extension', 'resolution', 'purity']
+
+# 与基线比较的指标，True 表示越大越好
+GATED_METRICS = {
+    'pages_per_sec': True,
+    'mb_per_sec': True,
+    'request_p99_ms': False,
+    'peak_rss_mb': False,
+    'lxml_pages_per_sec': True,
+    'bs4_pages_per_sec': True,
+    'import_ms': False,
+    'startup_ms': False,
+}
+
+
+def wallpaper_id(n):
+    """第 n 个合成壁纸的 ID"""
+    return f"{n:06x}"
+
+
+def true_extension(n):
+    """合成壁纸的真实扩展名，每三张中有一张 PNG"""
+    return 'png' if n % 3 == 0 else 'jpg'
+
+
+class FakeWallhavenHandler(BaseHTTPRequestHandler):
+    """Wallhaven 替身服务器的请求处理器"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.handle_request(head=True)
+
+    def do_GET(self):
+        self.handle_request(head=False)
+
+    def handle_request(self, head):
+        options = self.server.options
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        page = int(query.get('page', ['1'])[0])
+        if options['latency']:
+            time.sleep(options['latency'])
+
+        if self.server.should_inject('throttle_rate'):
+            self.send_body(429, b'Too Many Requests', 'text/plain', head)
+            return
+
+        path = parsed.path
+        if path == '/_bench/upload':
+            # 基准测试的控制接口：模拟新上传壁纸
+            self.server.upload(int(query.get('count', ['1'])[0]))
+            self.send_body(200, b'ok', 'text/plain', head)
+        elif path in ('/latest', '/toplist', '/random', '/search'):
+            self.send_body(200, self.server.listing_html(page).encode('utf-8'), 'text/html; charset=UTF-8', head)
+        elif path == '/api/v1/search':
+            self.send_body(200, self.server.api_json(page).encode('utf-8'), 'application/json', head)
+        elif path.startswith('/w/'):
+            self.send_body(200, self.server.detail_html(path[3:]).encode('utf-8'), 'text/html; charset=UTF-8', head)
+        elif path.startswith('/full/'):
+            self.send_image(path, head)
+        else:
+            self.send_body(404, b'Not Found', 'text/plain', head)
+
+    def send_body(self, status, body, content_type, head):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.write_throttled(body)
+
+    def send_image(self, path, head):
+        match = re.match(r'/full/\w+/wallhaven-(\w+)\.(\w+)$', path)
+        if not match or match.group(2) != true_extension(int(match.group(1), 16)):
+            self.send_body(404, b'Not Found', 'text/plain', head)
+            return
+
+        n = int(match.group(1), 16)
+        body = self.server.images[match.group(2), self.server.is_large(n)]
+        # 在文件头之后写入壁纸 ID，使每张图片的内容都不同
+        body = body[:8] + match.group(1).encode('ascii') + body[8 + len(match.group(1)):]
+        start = 0
+        range_match = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        if range_match:
+            start = int(range_match.group(1))
+            if start >= len(body):
+                self.send_body(416, b'', 'text/plain', head)
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'image/png' if match.group(2) == 'png' else 'image/jpeg')
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+        if head:
+            return
+
+        if self.server.should_inject('drop_rate'):
+            # 只发送一半内容后断开连接，模拟下载中途掉线
+            self.write_throttled(body[start:start + (len(body) - start) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        self.write_throttled(body[start:])
+
+    def write_throttled(self, body):
+        """按配置的单连接带宽分块发送"""
+        bandwidth = self.server.options['bandwidth']
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        chunk_size = 64 * 1024
+        for offset in range(0, len(body), chunk_size):
+            chunk = body[offset:offset + chunk_size]
+            self.wfile.write(chunk)
+            time.sleep(len(chunk) / bandwidth)
+
+
+class FakeWallhavenServer(ThreadingHTTPServer):
+    """本地 Wallhaven 替身服务器，列表页、详情页和图片均由壁纸序号确定性生成"""
+    daemon_threads = True
+    request_queue_size = 1024
+
+    # 大图是普通图片的倍数
+    LARGE_FACTOR = 16
+
+    def __init__(self, latency=0.0, bandwidth=0, image_size=256 * 1024, throttle_rate=0.0, drop_rate=0.0, mismatch_rate=0.0, large_every=0, seed=0,
+                 uploaded=0):
+        super().__init__(('127.0.0.1', 0), FakeWallhavenHandler)
+        # 已上传的壁纸数量，大于 0 时列表页从最新的一张开始列出
+        self.uploaded = uploaded
+        self.options = {
+            'latency': latency,
+            'bandwidth': bandwidth,
+            'throttle_rate': throttle_rate,
+            'drop_rate': drop_rate,
+            'mismatch_rate': mismatch_rate,
+            'large_every': large_every,
+        }
+        self.base_url = f"http://127.0.0.1:{self.server_port}"
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        # 带正确文件头的合成图片，键为 (扩展名, 是否为大图)
+        large_size = image_size * self.LARGE_FACTOR
+        filler = bytes(range(256)) * (large_size // 256 + 1)
+        self.images = {}
+        for extension, magic in (('jpg', b'\xff\xd8\xff\xe0'), ('png', b'\x89PNG\r\n\x1a\n')):
+            self.images[extension, False] = (magic + filler)[:image_size]
+            self.images[extension, True] = (magic + filler)[:large_size]
+
+    def page_items(self, page):
+        """第 page 页列出的壁纸编号；设置了 uploaded 时按上传顺序从新到旧排列，模拟 latest"""
+        if not self.uploaded:
+            return range((page - 1) * PER_PAGE, page * PER_PAGE)
+        newest = self.uploaded - 1 - (page - 1) * PER_PAGE
+        return range(newest, max(-1, newest - PER_PAGE), -1)
+
+    def upload(self, count):
+        """模拟新上传 count 张壁纸"""
+        self.uploaded += count
+
+    def is_large(self, n):
+        """按 large_every 确定哪些壁纸是 8K 大图"""
+        return bool(self.options['large_every']) and n % self.options['large_every'] == 0
+
+    def resolution(self, n):
+        """合成壁纸的分辨率"""
+        return (7680, 4320) if self.is_large(n) else (1920, 1080)
+
+    def handle_error(self, request, client_address):
+        # 客户端在故障注入后断开连接属于预期情况，不输出堆栈
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def should_inject(self, option):
+        """按配置的比例随机决定是否注入故障"""
+        rate = self.options[option]
+        if not rate:
+            return False
+        with self._random_lock:
+            return self._random.random() < rate
+
+    def listed_extension(self, n):
+        """列表页中显示的扩展名，按 mismatch_rate 故意标错一部分，用于测试 404 后修正扩展名的路径"""
+        extension = true_extension(n)
+        if self.options['mismatch_rate'] and (n * 2654435761) % 1000 < self.options['mismatch_rate'] * 1000:
+            return 'jpg' if extension == 'png' else 'png'
+        return extension
+
+    def listing_html(self, page):
+        """按 Wallhaven 列表页结构生成第 page 页"""
+        figures = []
+        for n in self.page_items(page):
+            wid = wallpaper_id(n)
+            width, height = self.resolution(n)
+            ext_span = '<span class="png"><span>PNG</span></span>' if self.listed_extension(n) == 'png' else ''
+            figures.append(
+                f'<li><figure class="thumb thumb-{wid} thumb-sfw thumb-general" data-wallpaper-id="{wid}" style="width:300px;height:200px">'
+                f'<img alt="loading" class="lazyload" data-src="{self.base_url}/small/{wid[:2]}/{wid}.jpg" src="">'
+                f'<a class="preview" href="{self.base_url}/w/{wid}" target="_blank"></a>'
+                f'<div class="thumb-info"><span class="wall-res">{width} x {height}</span>'
+                f'<a class="jsAnchor overlay-anchor wall-favs" data-href="{self.base_url}/wallpaper/fav/{wid}">{n % 97}<i class="fas fa-fw fa-star"></i></a>'
+                f'{ext_span}</div></figure></li>'
+            )
+        return (
+            '<!DOCTYPE html><html><head><title>Latest Wallpapers - Wallhaven.cc</title></head><body>'
+            '<header id="header"><nav><ul><li><a href="/latest">Latest</a></li><li><a href="/toplist">Toplist</a></li></ul></nav></header>'
+            f'<main><div id="thumbs"><section class="thumb-listing-page"><header class="thumb-listing-page-header"><h2>Page <span class="thumb-listing-page-num">{page}</span></h2></header>'
+            f'<ul>{"".join(figures)}</ul></section></div></main></body></html>'
+        )
+
+    def api_json(self, page):
+        """按 Wallhaven API 搜索结果结构生成第 page 页"""
+        data = []
+        for n in self.page_items(page):
+            wid = wallpaper_id(n)
+            extension = true_extension(n)
+            width, height = self.resolution(n)
+            data.append({
+                'id': wid,
+                'url': f"{self.base_url}/w/{wid}",
+                'short_url': f"{self.base_url}/{wid}",
+                'purity': 'sfw',
+                'category': 'general',
+                'resolution': f'{width}x{height}',
+                'file_size': len(self.images[extension, self.is_large(n)]),
+                'colors': [f"#{(n * 2654435761 + i) % 0xFFFFFF:06x}" for i in range(5)],
+                'file_type': 'image/png' if extension == 'png' else 'image/jpeg',
+                'path': f"{self.base_url}/full/{wid[:2]}/wallhaven-{wid}.{extension}",
+                'thumbs': {'large': '', 'original': '', 'small': f"{self.base_url}/small/{wid[:2]}/{wid}.jpg"},
+            })
+        return json.dumps({'data': data, 'meta': {'current_page': page, 'last_page': 10000, 'per_page': PER_PAGE, 'total': 10000 * PER_PAGE}})
+
+    def detail_html(self, wid):
+        """按 Wallhaven 详情页结构生成壁纸详情页"""
+        n = int(wid, 16)
+        extension = true_extension(n)
+        width, height = self.resolution(n)
+        size_kib = len(self.images[extension, self.is_large(n)]) / 1024
+        tags = ''.join(f'<li class="tag tag-sfw"><a class="tagname" href="{self.base_url}/tag/{i}">{tag}</a></li>'
+                       for i, tag in enumerate(['nature', 'landscape', 'digital art'][:1 + n % 3]))
+        colors = ''.join(f'<li class="color" style="background-color:#{(n * 2654435761 + i) % 0xFFFFFF:06x}"></li>' for i in range(5))
+        return (
+            f'<!DOCTYPE html><html><head><title>{wid} - Wallhaven.cc</title></head><body>'
+            f'<main><section id="showcase"><div class="scrollbox">'
+            f'<img id="wallpaper" src="{self.base_url}/full/{wid[:2]}/wallhaven-{wid}.{extension}" alt="wallpaper" data-wallpaper-id="{wid}">'
+            f'</div></section><aside id="showcase-sidebar"><div class="sidebar-content">'
+            f'<h3 class="showcase-resolution">{width} x {height}</h3>'
+            f'<ul class="color-palette">{colors}</ul>'
+            f'<ul id="tags">{tags}</ul>'
+            f'<div data-storage-id="showcase-info"><dl><dt>Category</dt><dd>General</dd><dt>Purity</dt><dd><span class="purity sfw">SFW</span></dd>'
+            f'<dt>Size</dt><dd>{size_kib:.1f} KiB</dd></dl></div>'
+            f'</div></aside></main></body></html>'
+        )
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class RecordingMetrics(Metrics):
+    """额外保存原始观测值的指标收集器，用于计算精确的分位数"""
+
+    def __init__(self):
+        super().__init__()
+        self.samples = {}
+
+    def observe(self, name, value, **labels):
+        super().observe(name, value, **labels)
+        with self._lock:
+            self.samples.setdefault(name, []).append(value)
+
+    def percentile(self, name, q):
+        values = sorted(self.samples.get(name, []))
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def cpu_seconds():
+    """当前进程已使用的 CPU 时间（用户态 + 内核态）"""
+    times = os.times()
+    return times.user + times.system
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存 (MB)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位为 KB，macOS 上为字节
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def check_listing_parity(spider, base_url, page_num):
+    """用两种列表数据来源解析同一页，返回不一致之处的描述列表"""
+    html_wallpapers = spider.parse_listing_page(spider.request('GET', f"{base_url}/latest", params={'page': page_num}).text)
+    api_wallpapers = spider.parse_api_listing(spider.request('GET', f"{base_url}/api/v1/search", params={'page': page_num}).text)
+    html_ids = [wallpaper['id'] for wallpaper in html_wallpapers]
+    api_ids = [wallpaper['id'] for wallpaper in api_wallpapers]
+    if html_ids != api_ids:
+        return [f"第 {page_num} 页: 壁纸 ID 不一致 (HTML {len(html_ids)} 个, API {len(api_ids)} 个)"]
+    mismatches = []
+    for html_wallpaper, api_wallpaper in zip(html_wallpapers, api_wallpapers):
+        for field in PARITY_FIELDS:
+            if html_wallpaper.get(field) != api_wallpaper.get(field):
+                mismatches.append(f"第 {page_num} 页 {html_wallpaper['id']}: {field} HTML={html_wallpaper.get(field)!r} API={api_wallpaper.get(field)!r}")
+    return mismatches
+
+
+def measure_parser(parse, html_text, iterations):
+    """重复解析同一页，返回 (每秒解析页数, 单次解析的峰值内存分配 KB, 解析出的壁纸数)"""
+    tracemalloc.start()
+    try:
+        count = len(parse(html_text))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        parse(html_text)
+    elapsed = time.perf_counter() - started
+    return round(iterations / elapsed, 1), round(peak / 1024, 1), count
+
+
+def run_scenario(name, base_url, pages, config_file=None, threads=None, rate=None, page_workers=None):
+    """在当前进程中运行一个场景，返回测量结果"""
+    scenario = SCENARIOS[name]
+    workdir = tempfile.mkdtemp(prefix='wallhaven-bench-')
+    try:
+        config = dict(DEFAULT_CONFIG)
+        if config_file:
+            with open(config_file, 'r', encoding='utf-8') as f:
+                config.update(json.load(f))
+        config.update(scenario.get('config', {}))
+        config.update(download_dir=workdir, index_file='', metrics_file='', metrics_port=0)
+        if threads:
+            config['max_threads'] = threads
+        if page_workers:
+            config['max_page_workers'] = page_workers
+        if rate:
+            # 测量代码本身的吞吐量时放开速率限制，否则结果只反映配置的请求间隔
+            config.update(delay_between_requests=0, max_requests_per_second=rate)
+        config_path = os.path.join(workdir, 'config.json')
+        with open(config_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f)
+
+        spider = WallhavenSpider(config_path, console=Console(quiet=True))
+        spider.base_url = spider.image_base_url = base_url
+        spider.api_url = f"{base_url}/api/v1"
+        spider.metrics = RecordingMetrics()
+
+        # 记录每个下载完成的时刻，平均完成时刻越小说明越多文件越早完成
+        completed_at = []
+        index_downloaded = spider.index_downloaded
+
+        def record_completion(wallpaper, category):
+            completed_at.append(time.perf_counter() - started)
+            index_downloaded(wallpaper, category)
+
+        spider.index_downloaded = record_completion
+
+        cpu_started = cpu_seconds()
+        started = time.perf_counter()
+        if 'details' in scenario:
+            urls = [f"{base_url}/w/{wallpaper_id(n)}" for n in range(scenario['details'])]
+            with ThreadPoolExecutor(max_workers=spider.config.get('max_threads', 5)) as executor:
+                details = list(executor.map(spider.get_wallpaper_details, urls))
+            fetched = sum(1 for d in details if d)
+            stats = {'total': len(urls), 'success': fetched, 'failed': len(urls) - fetched, 'failed_pages': 0, 'details_fetched': fetched}
+            page_count = 0
+        elif 'parser' in scenario:
+            html_text = spider.request('GET', f"{base_url}/latest", params={'page': 1}).text
+            # 只有一个请求，不参与请求延迟的基线比较
+            spider.metrics = RecordingMetrics()
+            parsers = {'bs4': spider.parse_listing_page_bs4}
+            if wallhaven_spider.load_lxml() is not None:
+                parsers['lxml'] = spider.parse_listing_page_lxml
+            measured = {parser: measure_parser(parse, html_text, pages) for parser, parse in parsers.items()}
+            # 两种解析器解析出的壁纸数量不同说明其中一个已经跟不上页面结构
+            failed = 0 if len({count for _, _, count in measured.values()}) == 1 else 1
+            stats = {'total': PER_PAGE, 'success': PER_PAGE, 'failed': failed, 'failed_pages': 0, 'parsers': {
+                f"{parser}_{key}": value for parser, values in measured.items()
+                for key, value in zip(('pages_per_sec', 'alloc_kb'), values)}}
+            page_count = 0
+        elif 'parity' in scenario:
+            mismatches = []
+            for page_num in range(1, pages + 1):
+                mismatches.extend(check_listing_parity(spider, base_url, page_num))
+            stats = {'total': pages * PER_PAGE, 'success': pages * PER_PAGE - len(mismatches), 'failed': len(mismatches),
+                     'failed_pages': 0, 'mismatches': mismatches[:10]}
+            page_count = pages * 2
+        elif 'watch' in scenario:
+            # 首次同步建立高水位标记，之后每轮先模拟新上传，再同步
+            spider.sync_query('latest')
+            stats = {'total': 0, 'success': 0, 'failed': 0, 'failed_pages': 0}
+            page_count = 0
+            for _ in range(scenario['watch']['cycles']):
+                spider.request('GET', f"{base_url}/_bench/upload", params={'count': scenario['watch']['uploads']})
+                cycle = spider.sync_query('latest')
+                page_count += cycle['pages']
+                for key in ('total', 'success', 'failed'):
+                    stats[key] += cycle[key]
+        else:
+            page_count = pages
+            stats = spider.run_job('latest', list(range(1, pages + 1)), download=scenario.get('download', True))
+        elapsed = time.perf_counter() - started
+
+        cpu = cpu_seconds() - cpu_started
+        downloaded = sum(value for (key, _), value in spider.metrics.counters.items() if key == 'downloaded_bytes')
+        disk_writes = sum(value for (key, _), value in spider.metrics.counters.items() if key == 'disk_writes')
+        files = stats['success'] if scenario.get('download', True) else 0
+        metrics = spider.metrics
+        return {
+            'scenario': name,
+            'elapsed': round(elapsed, 3),
+            'pages': page_count - stats.get('failed_pages', 0),
+            'pages_per_sec': round((page_count - stats.get('failed_pages', 0)) / elapsed, 2) if page_count else None,
+            'downloads': stats['success'] if scenario.get('download', True) else 0,
+            'failed': stats['failed'] + stats.get('failed_pages', 0),
+            'mb': round(downloaded / (1024 * 1024), 2),
+            'mb_per_sec': round(downloaded / (1024 * 1024) / elapsed, 2) if downloaded else None,
+            'request_p50_ms': round(metrics.percentile('request_seconds', 0.5) * 1000, 2),
+            'request_p99_ms': round(metrics.percentile('request_seconds', 0.99) * 1000, 2),
+            'download_p50_ms': round(metrics.percentile('download_seconds', 0.5) * 1000, 2),
+            'download_p99_ms': round(metrics.percentile('download_seconds', 0.99) * 1000, 2),
+            'mean_completion_s': round(sum(completed_at) / len(completed_at), 3) if completed_at else None,
+            'parse_p50_ms': round(metrics.percentile('parse_seconds', 0.5) * 1000, 3),
+            'details': stats.get('details_fetched', 0),
+            'retries': stats.get('retries', 0),
+            'throttled': stats.get('throttled', 0),
+            'cpu_ms_per_file': round(cpu * 1000 / files, 3) if files else None,
+            'writes_per_file': round(disk_writes / files, 1) if files else None,
+            'peak_rss_mb': peak_rss_mb(),
+            **({'mismatches': stats['mismatches']} if 'mismatches' in stats else {}),
+            **stats.get('parsers', {}),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def parse_import_time(output, module):
+    """从 python -X importtime 的输出中取出模块的累计导入耗时 (微秒)"""
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1])
+    return None
+
+
+def run_startup(name, base_url, config_file=None, rate=None):
+    """在全新的解释器中重复运行一次短时任务，测量模块导入耗时和从启动进程到退出的总耗时"""
+    workdir = tempfile.mkdtemp(prefix='wallhaven-bench-')
+    try:
+        config = dict(DEFAULT_CONFIG)
+        if config_file:
+            with open(config_file, 'r', encoding='utf-8') as f:
+                config.update(json.load(f))
+        # 关闭响应缓存，每次运行都真正请求列表页
+        config.update(download_dir=workdir, index_file='', metrics_file='', metrics_port=0, use_cache=False)
+        if rate:
+            config.update(delay_between_requests=0, max_requests_per_second=rate)
+        config_path = os.path.join(workdir, 'config.json')
+        with open(config_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f)
+
+        command = [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT, base_url, config_path]
+        import_times, startup_times = [], []
+        for _ in range(STARTUP_RUNS):
+            started = time.perf_counter()
+            completed = subprocess.run(command, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            startup_times.append(time.perf_counter() - started)
+            if completed.returncode != 0:
+                lines = [line for line in completed.stderr.splitlines() if not line.startswith('import time:')]
+                return {'scenario': name, 'error': lines[-1] if lines else f"退出码 {completed.returncode}"}
+            import_times.append(parse_import_time(completed.stderr, 'wallhaven_spider'))
+            outcome = json.loads(completed.stdout.strip().splitlines()[-1])
+        # 第一次运行会编译 .pyc 并填充文件缓存，不计入结果
+        return {
+            'scenario': name,
+            'elapsed': round(sum(startup_times), 3),
+            'pages': 1,
+            'downloads': 0,
+            'failed': outcome['failed'],
+            'import_ms': round(min(import_times[1:]) / 1000, 1),
+            'startup_ms': round(min(startup_times[1:]) * 1000, 1),
+            'loaded_modules': outcome['loaded'],
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_in_subprocess(name, args, page_workers=None):
+    """启动替身服务器，在独立子进程中运行场景，使峰值内存互不影响"""
+    scenario = SCENARIOS[name]
+    server_options = {
+        'latency': args.latency / 1000,
+        'bandwidth': args.bandwidth * 1024,
+        'image_size': args.image_kb * 1024,
+        'seed': args.seed,
+        **scenario.get('server', {}),
+    }
+    server = FakeWallhavenServer(**server_options).start()
+    try:
+        if scenario.get('startup'):
+            return run_startup(name, server.base_url, args.config, args.rate)
+        pages = max(1, scenario.get('pages', 0) // 10) if args.quick else scenario.get('pages', 0)
+        command = [sys.executable, os.path.abspath(__file__), '--worker', name, '--server-url', server.base_url, '--pages', str(pages)]
+        if args.config:
+            command += ['--config', args.config]
+        if args.threads:
+            command += ['--threads', str(args.threads)]
+        if args.rate:
+            command += ['--rate', str(args.rate)]
+        if page_workers:
+            command += ['--page-workers', str(page_workers)]
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode != 0:
+            return {'scenario': name, 'error': completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else f"退出码 {completed.returncode}"}
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        if page_workers:
+            result.update(scenario=f"{name}@{page_workers}", page_workers=page_workers)
+        return result
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def listing_record(n, kind):
+    """模拟列表页解析出的第 n 条壁纸记录，kind 为 dict（旧版字典记录）或 wallpaper"""
+    wid = wallpaper_id(n)
+    site, image_base = "https://wallhaven.cc", "https://w.wallhaven.cc"
+    thumb_url = f"https://th.wallhaven.cc/small/{wid[:2]}/{wid}.jpg"
+    # 和解析 HTML 时一样，扩展名和分辨率每次都是新的字符串对象
+    extension = ''.join(true_extension(n))
+    width, height = MEMORY_RESOLUTIONS[n % len(MEMORY_RESOLUTIONS)]
+    resolution = f"{width} x {height}"
+    if kind == 'dict':
+        return {
+            'id': wid,
+            'url': f"{site}/w/{wid}",
+            'thumb_url': thumb_url,
+            'download_url': f"{image_base}/full/{wid[:2]}/wallhaven-{wid}.{extension}",
+            'extension': extension,
+            'resolution': resolution,
+            'size': format_size(None),
+            'file_size': None
+        }
+    return Wallpaper(wid, site, image_base, extension, resolution, url=f"{site}/w/{wid}", thumb_url=thumb_url)
+
+
+def measure_record_memory(count, kind):
+    """测量保存 count 条记录所需的内存 (字节) 和构建耗时"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        records = [listing_record(n, kind) for n in range(count)]
+        elapsed = time.perf_counter() - started
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del records
+    return used, elapsed
+
+
+def run_memory_benchmark(counts):
+    """比较旧版字典记录和 Wallpaper 记录的内存占用"""
+    results = []
+    for count in counts:
+        dict_bytes, dict_seconds = measure_record_memory(count, 'dict')
+        slot_bytes, slot_seconds = measure_record_memory(count, 'wallpaper')
+        results.append({
+            'records': count,
+            'dict_mb': round(dict_bytes / 1024 / 1024, 1),
+            'wallpaper_mb': round(slot_bytes / 1024 / 1024, 1),
+            'dict_bytes_per_record': round(dict_bytes / count),
+            'wallpaper_bytes_per_record': round(slot_bytes / count),
+            'saved_percent': round((1 - slot_bytes / dict_bytes) * 100, 1),
+            'dict_build_s': round(dict_seconds, 3),
+            'wallpaper_build_s': round(slot_seconds, 3),
+        })
+    return results
+
+
+def print_memory_results(console, results):
+    """以表格形式输出内存基准测试结果"""
+    table = Table(title="壁纸记录内存占用")
+    columns = [
+        ('记录数', 'records'), ('字典(MB)', 'dict_mb'), ('Wallpaper(MB)', 'wallpaper_mb'), ('字典(B/条)', 'dict_bytes_per_record'),
+        ('Wallpaper(B/条)', 'wallpaper_bytes_per_record'), ('节省(%)', 'saved_percent'), ('字典构建(s)', 'dict_build_s'),
+        ('Wallpaper构建(s)', 'wallpaper_build_s'),
+    ]
+    for title, _ in columns:
+        table.add_column(title, justify='right')
+    for result in results:
+        table.add_row(*[str(result[key]) for _, key in columns])
+    console.print(table)
+
+
+def run_page_worker_sweep(name, args):
+    """按 --page-workers 中的每个并发数运行一次场景，计算相对第一个并发数的页/秒加速比"""
+    results = [run_in_subprocess(name, args, page_workers) for page_workers in args.page_workers]
+    base = results[0].get('pages_per_sec')
+    for result in results:
+        result['speedup'] = round(result['pages_per_sec'] / base, 2) if base and result.get('pages_per_sec') else None
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """与基线比较，返回回归描述列表"""
+    regressions = []
+    baseline_by_name = {result['scenario']: result for result in baseline.get('results', [])}
+    for result in results:
+        if 'error' in result:
+            regressions.append(f"{result['scenario']}: 运行出错 ({result['error']})")
+            continue
+        if result['failed']:
+            regressions.append(f"{result['scenario']}: {result['failed']} 个失败")
+        previous = baseline_by_name.get(result['scenario'])
+        if not previous:
+            continue
+        for metric, higher_is_better in GATED_METRICS.items():
+            current, before = result.get(metric), previous.get(metric)
+            if not current or not before:
+                continue
+            if higher_is_better and current < before * (1 - tolerance):
+                regressions.append(f"{result['scenario']}: {metric} {before} -> {current}")
+            elif not higher_is_better and current > before * (1 + tolerance):
+                regressions.append(f"{result['scenario']}: {metric} {before} -> {current}")
+    return regressions
+
+
+def print_results(console, results):
+    """以表格形式输出测量结果"""
+    table = Table(title="Wallhaven 爬虫基准测试")
+    columns = [
+        ('场景', 'scenario'), ('耗时(s)', 'elapsed'), ('页/秒', 'pages_per_sec'), ('下载数', 'downloads'),
+        ('失败', 'failed'), ('MB/秒', 'mb_per_sec'), ('请求p50(ms)', 'request_p50_ms'), ('请求p99(ms)', 'request_p99_ms'),
+        ('下载p99(ms)', 'download_p99_ms'), ('CPU(ms/文件)', 'cpu_ms_per_file'), ('重试', 'retries'), ('峰值内存(MB)', 'peak_rss_mb'),
+    ]
+    for title, _ in columns:
+        table.add_column(title, justify='left' if title == '场景' else 'right')
+    # 启动耗时场景的指标与吞吐量无关，单独输出
+    startup_results = [result for result in results if 'startup_ms' in result]
+    for result in results:
+        if result in startup_results:
+            continue
+        if 'error' in result:
+            table.add_row(result['scenario'], f"[red]{result['error']}[/red]", *[''] * (len(columns) - 2))
+            continue
+        table.add_row(*['-' if result.get(key) is None else str(result[key]) for _, key in columns])
+    console.print(table)
+
+    parser_results = [result for result in results if 'bs4_pages_per_sec' in result]
+    if parser_results:
+        parser_table = Table(title="列表页解析器")
+        for title in ('场景', '解析器', '页/秒', '内存(KB/页)'):
+            parser_table.add_column(title, justify='left' if title in ('场景', '解析器') else 'right')
+        for result in parser_results:
+            for parser in ('lxml', 'bs4'):
+                if f"{parser}_pages_per_sec" in result:
+                    parser_table.add_row(result['scenario'], parser, str(result[f"{parser}_pages_per_sec"]), str(result[f"{parser}_alloc_kb"]))
+        console.print(parser_table)
+
+    if startup_results:
+        startup_table = Table(title="启动耗时")
+        for title in ('场景', '导入(ms)', '启动(ms)', '失败', '已加载的可选组件'):
+            startup_table.add_column(title, justify='left' if title in ('场景', '已加载的可选组件') else 'right')
+        for result in startup_results:
+            startup_table.add_row(result['scenario'], str(result['import_ms']), str(result['startup_ms']), str(result['failed']),
+                                  ', '.join(result['loaded_modules']) or '-')
+        console.print(startup_table)
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Wallhaven 爬虫离线基准测试")
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS), help="要运行的场景，可重复指定，默认运行全部")
+    parser.add_argument('--quick', action='store_true', help="页数缩小为十分之一，适合快速回归检查")
+    parser.add_argument('--latency', type=float, default=20, help="替身服务器每个请求的延迟 (毫秒)，默认 20")
+    parser.add_argument('--bandwidth', type=int, default=0, help="单连接带宽上限 (KB/秒)，默认不限")
+    parser.add_argument('--image-kb', type=int, default=256, help="合成图片大小 (KB)，默认 256")
+    parser.add_argument('--threads', type=int, help="覆盖 max_threads")
+    parser.add_argument('--config', help="爬虫配置文件，默认使用内置默认配置")
+    parser.add_argument('--rate', type=float, default=1000, help="每秒最大请求数，默认 1000；设为 0 时使用配置中的速率限制")
+    parser.add_argument('--seed', type=int, default=0, help="故障注入的随机种子")
+    parser.add_argument('--save', help="把结果保存为基线文件")
+    parser.add_argument('--compare', help="与基线文件比较，有回归时退出码为 1")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="允许的相对退化比例，默认 0.2")
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出结果")
+    parser.add_argument('--page-workers', type=lambda value: [int(part) for part in value.split(',')],
+                        help="列表页并发数，逗号分隔，如 1,4,8；listing 和 listing-api 场景按每个并发数各运行一次，用于检查并行获取的加速比和共享速率限制")
+    parser.add_argument('--memory', action='store_true', help="只运行壁纸记录的内存基准测试（1 万 / 10 万 / 100 万条，--quick 时不含 100 万）")
+    # 内部参数：在子进程中运行单个场景
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--server-url', help=argparse.SUPPRESS)
+    parser.add_argument('--pages', type=int, help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if args.worker:
+        page_workers = args.page_workers[0] if args.page_workers else None
+        print(json.dumps(run_scenario(args.worker, args.server_url, args.pages, args.config, args.threads, args.rate, page_workers)))
+        return 0
+
+    console = Console(stderr=args.json)
+    if args.memory:
+        results = run_memory_benchmark(MEMORY_COUNTS[:-1] if args.quick else MEMORY_COUNTS)
+        if args.json:
+            print(json.dumps(results, ensure_ascii=False))
+        else:
+            print_memory_results(console, results)
+        return 0
+
+    results = []
+    for name in args.scenario or list(SCENARIOS):
+        requirement = SCENARIOS[name].get('requires')
+        if requirement == 'aiohttp' and wallhaven_spider.load_async_backend() is None:
+            console.print(f"[yellow]跳过 {name}: 未安装 aiohttp[/yellow]")
+            continue
+        console.print(f"[cyan]运行场景 {name}: {SCENARIOS[name]['description']}...[/cyan]")
+        if args.page_workers and SCENARIOS[name].get('page_worker_sweep'):
+            results.extend(run_page_worker_sweep(name, args))
+        else:
+            results.append(run_in_subprocess(name, args))
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False))
+    else:
+        print_results(console, results)
+        for result in results:
+            if result.get('speedup') is not None:
+                console.print(f"[cyan]{result['scenario']}: {result['pages_per_sec']} 页/秒，加速比 {result['speedup']}x[/cyan]")
+            for mismatch in result.get('mismatches', []):
+                console.print(f"[red]{result['scenario']} 不一致: {mismatch}[/red]")
+
+    options = {key: getattr(args, key) for key in ('quick', 'latency', 'bandwidth', 'image_kb', 'threads', 'rate', 'seed', 'page_workers')}
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'options': options, 'results': results}, f, ensure_ascii=False, indent=2)
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('options') != options:
+            console.print("[yellow]警告: 基线使用的参数与本次不同，比较结果可能不准确[/yellow]")
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        for regression in regressions:
+            console.print(f"[red]回归: {regression}[/red]")
+        if regressions:
+            exit_code = 1
+        else:
+            console.print("[green]与基线相比没有回归[/green]")
+    elif any('error' in result or result['failed'] for result in results):
+        exit_code = 1
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,69 +8,1498 @@ Wallhaven 爬虫程序
 """
 
 import re
+import sys
 import requests
 from urllib.parse import urljoin, urlparse
-from bs4 import BeautifulSoup
 import os
 import time
 import json
-from rich.console import Console
-from rich.table import Table
-from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn
-from rich.prompt import Prompt, IntPrompt
 import argparse
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import queue
+from collections import deque
 import signal
+import socket
+import bisect
+import hashlib
+import random
+import string
+import shutil
+from email.utils import parsedate_to_datetime
+from contextlib import contextmanager
+import http.client
+import urllib3
+from requests.adapters import HTTPAdapter
+
+# 解析器 (bs4 / lxml)、界面 (rich)、asyncio 后端和 Parquet 导出都在第一次用到时才导入，
+# 定时任务这类短时运行不需要为用不到的组件付出导入时间。
+# 可选依赖在下面的函数中用 import 语句导入而不是按名称动态导入，打包为可执行文件时仍能被识别；
+# 尝试过但未安装的记为 False，避免每次调用都重新查找
+lxml_html = None
+aiohttp = None
+asyncio = None
+pyarrow = None
+
+
+def load_lxml():
+    """按需导入 lxml.html，未安装时返回 None"""
+    global lxml_html
+    if lxml_html is None:
+        try:
+            from lxml import html as lxml_module
+        except ImportError:
+            lxml_module = False
+        lxml_html = lxml_module
+    return lxml_html or None
+
+
+def load_async_backend():
+    """按需导入 asyncio 后端依赖 (asyncio、aiohttp)，未安装 aiohttp 时返回 None"""
+    global aiohttp, asyncio
+    if aiohttp is None:
+        try:
+            import aiohttp as aiohttp_module
+        except ImportError:
+            aiohttp_module = False
+        import asyncio as asyncio_module
+        asyncio, aiohttp = asyncio_module, aiohttp_module
+    return aiohttp or None
+
+
+def load_pyarrow():
+    """按需导入 pyarrow 和 pyarrow.parquet，未安装时返回 None"""
+    global pyarrow
+    if pyarrow is None:
+        try:
+            import pyarrow as pyarrow_module
+            # 导入子模块后可通过 pyarrow.parquet 访问
+            import pyarrow.parquet as pyarrow_parquet
+        except ImportError:
+            pyarrow_module = False
+        pyarrow = pyarrow_module
+    return pyarrow or None
+
+
+def connect_sqlite(db_path, **kwargs):
+    """打开 SQLite 数据库，sqlite3 在第一次打开数据库时才导入"""
+    import sqlite3
+    return sqlite3.connect(db_path, **kwargs)
+
+
+# 支持识别的壁纸扩展名
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'webp']
+RESOLUTION_PATTERN = re.compile(r'(\d+)\s*x\s*(\d+)')
+# 详情页中的文件大小，如 "2.3 MiB"
+SIZE_PATTERN = re.compile(r'([\d.]+)\s*([KMG]i?B|B)\b', re.IGNORECASE)
+SIZE_UNITS = {'B': 1, 'KB': 1024, 'KIB': 1024, 'MB': 1024 ** 2, 'MIB': 1024 ** 2, 'GB': 1024 ** 3, 'GIB': 1024 ** 3}
+COLOR_PATTERN = re.compile(r'#[0-9a-fA-F]{6}')
+PURITIES = ['sfw', 'sketchy', 'nsfw']
+# 可以通过详情页补全的字段
+DETAIL_FIELDS = ['download_url', 'resolution', 'file_size', 'tags', 'colors', 'purity']
+
+# 图片格式的文件头，用于校验下载内容是否为有效图片以及扩展名是否正确
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+]
+
+# 默认配置，配置文件中缺少的配置项会使用这里的值
+DEFAULT_CONFIG = {
+    "download_dir": "downloads",
+    "delay_between_requests": 1,
+    "max_pages_per_session": 10,
+    "image_formats": ["jpg", "jpeg", "png", "gif", "webp"],
+    "max_retries": 3,
+    "timeout": 30,
+    "max_page_workers": 4,
+    "stream_downloads": False,
+    "stream_queue_size": 64,
+    "io_backend": "thread",
+    "async_pool_size": 100,
+    "async_concurrency": 200,
+    "use_index": True,
+    "index_file": "",
+    "max_requests_per_second": 10,
+    "retry_backoff": 1,
+    "retry_backoff_max": 60,
+    "listing_backend": "html",
+    "api_key": "",
+    "api_seed": "",
+    "use_journal": True,
+    "use_cache": True,
+    "cache_max_mb": 64,
+    "cache_ttl": {
+        "random": 0,
+        "latest": 60,
+        "tag": 600,
+        "toplist": 600,
+        "toplist:1M": 3600,
+        "toplist:3M": 10800,
+        "toplist:6M": 21600,
+        "toplist:1y": 21600,
+        "details": 86400
+    },
+    "metrics_file": "",
+    "metrics_port": 0,
+    "metrics_host": "127.0.0.1",
+    "download_order": "balanced",
+    "large_file_seconds": 10,
+    "bandwidth_limit": 0,
+    "probe_sizes": False,
+    "verify_images": True,
+    "content_store": True,
+    "queue_lease_seconds": 300,
+    "queue_max_attempts": 3,
+    "result_view": "summary",
+    "result_page_size": 20,
+    "export_file": "",
+    "detail_fields": [],
+    "watch_interval": 600,
+    "watch_initial_pages": 1,
+    "watch_max_pages": 10,
+    "write_buffer_kb": 1024,
+    "preallocate": True,
+    "fsync_policy": "none",
+    "fsync_batch_mb": 32
+}
+
+# 需要重试的HTTP状态码
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# 写入磁盘的刷新策略：none 交给操作系统，file 每个文件完成时 fsync，batch 每写入 fsync_batch_mb 后 fsync 一次
+FSYNC_POLICIES = ['none', 'file', 'batch']
+
+# 同步模式支持的类别，结果需要按上传时间从新到旧排列
+WATCH_CATEGORIES = ['latest', 'tag']
+
+# 导出文件中每个壁纸记录的字段
+EXPORT_FIELDS = ['id', 'category', 'page', 'url', 'download_url', 'thumb_url', 'extension', 'resolution', 'file_size', 'purity', 'tags', 'colors',
+                 'crawled_at']
+
+
+class IncompleteDownloadError(Exception):
+    """下载的字节数与服务器声明的文件大小不一致"""
+
+
+class CorruptDownloadError(IncompleteDownloadError):
+    """下载的内容不是有效的图片，需要重新下载"""
+
+
+def detect_image_type(header):
+    """根据文件头判断图片格式，无法识别时返回 None"""
+    for signature, extension in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+class StreamVerifier:
+    """下载时逐块计算 SHA-256 并保留文件头，校验和去重都不需要重新读取文件"""
+
+    HEADER_SIZE = 16
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.header = b''
+
+    def update(self, chunk):
+        if len(self.header) < self.HEADER_SIZE:
+            self.header += chunk[:self.HEADER_SIZE - len(self.header)]
+        self.sha256.update(chunk)
+        self.size += len(chunk)
+
+    def resume(self, part_path, offset):
+        """续传前使状态与临时文件已有的内容一致，只有上次运行留下的临时文件才需要读取一遍"""
+        if self.size == offset:
+            return
+        self.reset()
+        if offset == 0:
+            return
+        with open(part_path, 'rb') as f:
+            while self.size < offset:
+                chunk = f.read(min(1024 * 1024, offset - self.size))
+                if not chunk:
+                    break
+                self.update(chunk)
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+class PartFileWriter:
+    """把下载内容写入 .part 临时文件
+
+    - 不经过 Python 的写缓冲，下载缓冲区中的数据直接交给 write 系统调用
+    - 从头下载且已知大小时按 Content-Length 预分配磁盘空间；预分配的文件先写入 .alloc，
+      写完（或中断时截断到实际写入的长度）后才改名为 .part，进程被强制结束留下的 .alloc 不会被当作可续传的内容
+    - 按 fsync_policy 把数据刷新到磁盘
+    """
+
+    def __init__(self, part_path, append, expected_size=None, preallocate=False, fsync_policy='none', fsync_batch_bytes=0):
+        self.part_path = part_path
+        self.alloc_path = part_path + '.alloc'
+        self.fsync_policy = fsync_policy
+        self.fsync_batch_bytes = fsync_batch_bytes
+        self.written = 0
+        self.writes = 0
+        self.fsyncs = 0
+        self._unsynced = 0
+        if os.path.exists(self.alloc_path):
+            os.remove(self.alloc_path)
+        self.expected_size = expected_size
+        self.preallocated = bool(preallocate and not append and expected_size and hasattr(os, 'posix_fallocate'))
+        if self.preallocated:
+            self.file = open(self.alloc_path, 'wb', buffering=0)
+            try:
+                os.posix_fallocate(self.file.fileno(), 0, expected_size)
+            except OSError:
+                # 文件系统不支持预分配时直接写入 .part
+                self.file.close()
+                os.remove(self.alloc_path)
+                self.preallocated = False
+        if not self.preallocated:
+            self.file = open(part_path, 'ab' if append else 'wb', buffering=0)
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[self.file.write(view):]
+            self.writes += 1
+        self.written += len(data)
+        self._unsynced += len(data)
+        if self.fsync_policy == 'batch' and self._unsynced >= self.fsync_batch_bytes:
+            self.fsync()
+
+    def fsync(self):
+        os.fsync(self.file.fileno())
+        self.fsyncs += 1
+        self._unsynced = 0
+
+    def close(self, complete):
+        """关闭文件，complete 为 False 时保留已写入的部分供续传"""
+        try:
+            # 连接提前断开时实际写入的内容比预分配的少，截断后文件大小才能反映下载进度
+            if self.preallocated and self.written != self.expected_size:
+                self.file.truncate(self.written)
+            if complete and self.fsync_policy != 'none' and self._unsynced:
+                self.fsync()
+        finally:
+            self.file.close()
+        if self.preallocated:
+            os.replace(self.alloc_path, self.part_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(exc_type is None)
+
+
+def format_size(file_size):
+    """把字节数格式化为易读的文件大小"""
+    if file_size is None:
+        return 'Unknown'
+    size = float(file_size)
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def parse_size(text):
+    """把 "2.3 MiB" 这样的文件大小解析为字节数，无法解析时返回 None"""
+    match = SIZE_PATTERN.search(text or '')
+    if not match:
+        return None
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+class Wallpaper:
+    """紧凑的壁纸记录
+
+    大规模爬取时会在内存中保存数十万条记录。这里用 __slots__ 代替字典，扩展名和分辨率使用驻留字符串，
+    详情页、原图和缩略图地址能由 ID 推出时不单独保存，访问时再生成。
+    同时保留 wp['id']、wp.get('file_size') 这样的字典式访问，原有代码和 JSON 序列化格式不变。
+    """
+
+    __slots__ = ('id', 'extension', 'resolution', 'file_size', 'purity', 'tags', 'colors', 'site', 'image_base', '_url', '_thumb_url', '_download_url')
+
+    FIELDS = ('id', 'url', 'thumb_url', 'download_url', 'extension', 'resolution', 'size', 'file_size', 'purity', 'tags', 'colors')
+    THUMB_BASE_URL = "https://th.wallhaven.cc"
+
+    def __init__(self, wallpaper_id, site, image_base, extension, resolution, file_size=None, url=None, thumb_url=None, download_url=None,
+                 purity=None, tags=None, colors=None):
+        self.id = wallpaper_id
+        self.site = site
+        self.image_base = image_base
+        self.extension = sys.intern(extension)
+        self.resolution = sys.intern(resolution)
+        self.file_size = file_size
+        # 标签、颜色和分级只有少数取值，同样使用驻留字符串；None 表示未知
+        self.purity = sys.intern(purity) if purity else None
+        self.tags = self.intern_all(tags)
+        self.colors = self.intern_all(colors)
+        self._download_url = None
+        self.url = url
+        self.thumb_url = thumb_url
+        self.download_url = download_url
+
+    @property
+    def url(self):
+        return self._url or f"{self.site}/w/{self.id}"
+
+    @url.setter
+    def url(self, value):
+        self._url = value if value and value != f"{self.site}/w/{self.id}" else None
+
+    @property
+    def thumb_url(self):
+        return self._thumb_url or f"{self.THUMB_BASE_URL}/small/{self.id[:2]}/{self.id}.jpg"
+
+    @thumb_url.setter
+    def thumb_url(self, value):
+        self._thumb_url = value if value and value != f"{self.THUMB_BASE_URL}/small/{self.id[:2]}/{self.id}.jpg" else None
+
+    def default_download_url(self):
+        id_prefix = self.id[:2] if len(self.id) >= 2 else 'xx'
+        return f"{self.image_base}/full/{id_prefix}/wallhaven-{self.id}.{self.extension}"
+
+    @property
+    def download_url(self):
+        return self._download_url or self.default_download_url()
+
+    @download_url.setter
+    def download_url(self, value):
+        self._download_url = value if value and value != self.default_download_url() else None
+
+    @property
+    def size(self):
+        return format_size(self.file_size)
+
+    @staticmethod
+    def intern_all(values):
+        return tuple(sys.intern(value) for value in values) if values is not None else None
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS or key == 'size':
+            raise KeyError(key)
+        if key in ('extension', 'resolution', 'purity') and value is not None:
+            value = sys.intern(value)
+        elif key in ('tags', 'colors'):
+            value = self.intern_all(value)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.FIELDS
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.FIELDS else default
+
+    def keys(self):
+        return self.FIELDS
+
+    def to_dict(self):
+        """转换为与旧版字典记录相同的结构，用于 JSON 序列化"""
+        record = {key: getattr(self, key) for key in self.FIELDS}
+        for key in ('tags', 'colors'):
+            if record[key] is not None:
+                record[key] = list(record[key])
+        return record
+
+    @classmethod
+    def from_dict(cls, data, site, image_base):
+        """从 JSON 记录（或旧版字典记录）恢复"""
+        return cls(data['id'], site, image_base, data.get('extension') or 'jpg', data.get('resolution') or 'Unknown',
+                   file_size=data.get('file_size'), url=data.get('url'), thumb_url=data.get('thumb_url'),
+                   download_url=data.get('download_url'), purity=data.get('purity'), tags=data.get('tags'), colors=data.get('colors'))
+
+    def __repr__(self):
+        return f"Wallpaper({self.to_dict()!r})"
+
+
+class RateLimiter:
+    """自适应请求速率限制器（AIMD），同一主机的所有请求共享同一个速率预算
+
+    响应正常时每次加性提高速率，直到 max_rate；遇到 429 时速率减半，
+    并按 Retry-After 暂停所有请求。
+    """
+
+    def __init__(self, initial_rate, max_rate, increase_step=0.5, min_rate=0.05):
+        self.max_rate = max(max_rate, min_rate)
+        self.min_rate = min_rate
+        self.increase_step = increase_step
+        self.rate = min(max(initial_rate, min_rate), self.max_rate)
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+        self._paused_until = 0.0
+
+    def reserve(self):
+        """预约下一个请求时间片，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_time, self._paused_until)
+            self._next_time = start + 1.0 / self.rate
+            return start - now
+
+    def acquire(self):
+        """阻塞直到可以发起下一个请求"""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def on_success(self):
+        """响应正常，加性提高速率"""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_throttle(self, retry_after=None):
+        """被服务器限流，速率减半并暂停所有请求"""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            pause = retry_after if retry_after is not None else 1.0 / self.rate
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+
+
+class BandwidthLimiter:
+    """全局下载带宽限制（令牌桶），所有下载共享同一个字节预算"""
+
+    def __init__(self, bytes_per_second):
+        self.rate = bytes_per_second
+        # 允许最多一秒的突发流量
+        self.burst = bytes_per_second
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, size):
+        """预约 size 字节的带宽，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= size
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self, size):
+        """阻塞直到 size 字节的带宽可用"""
+        delay = self.reserve(size)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class DownloadScheduler:
+    """按文件大小安排下载顺序，下载位空出时调用 next() 取下一个任务
+
+    - shortest: 总是先下载最小的文件，单位时间内完成的文件最多
+    - balanced: 其余下载位从小到大下载，同时保留少量下载位从最大的文件开始下载大文件，
+      避免大文件全部堆到最后或占满所有下载位；大文件的界限按实测的单个下载速度动态调整
+    - listing: 保持列表页顺序
+    """
+
+    # 还没有实测速度时，超过该大小的文件视为大文件
+    DEFAULT_LARGE_FILE_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, wallpapers, size_of, policy='balanced', workers=1, large_file_seconds=10):
+        self.policy = policy
+        self.large_slots = max(1, workers // 4)
+        self.large_file_seconds = large_file_seconds
+        self.sizes = {wallpaper['id']: size_of(wallpaper) for wallpaper in wallpapers}
+        if policy != 'listing':
+            wallpapers = sorted(wallpapers, key=lambda wallpaper: self.sizes[wallpaper['id']])
+        self._pending = deque(wallpapers)
+        self._large_running = set()
+        # 单个下载的平均速度（字节/秒），指数加权移动平均
+        self.throughput = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def large_file_size(self):
+        """当前大文件的界限：按实测速度预计下载时间超过 large_file_seconds 的文件"""
+        if self.throughput is None:
+            return self.DEFAULT_LARGE_FILE_SIZE
+        return self.throughput * self.large_file_seconds
+
+    def next(self):
+        """取下一个要下载的壁纸，没有剩余任务时返回 None"""
+        with self._lock:
+            if not self._pending:
+                return None
+            if self.policy == 'balanced' and len(self._large_running) < self.large_slots:
+                largest = self._pending[-1]
+                if self.sizes[largest['id']] >= self.large_file_size():
+                    self._large_running.add(largest['id'])
+                    return self._pending.pop()
+            return self._pending.popleft()
+
+    def finish(self, wallpaper, seconds, success=True):
+        """记录一个下载结束，用实测速度重新计算大文件界限"""
+        with self._lock:
+            self._large_running.discard(wallpaper['id'])
+            if success and seconds > 0:
+                speed = self.sizes[wallpaper['id']] / seconds
+                self.throughput = speed if self.throughput is None else 0.8 * self.throughput + 0.2 * speed
+
+
+class WallpaperIndex:
+    """本地壁纸索引，按壁纸ID记录已下载文件，避免重复请求和文件检查"""
+
+    def __init__(self, db_path):
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = connect_sqlite(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS wallpapers ("
+            " id TEXT PRIMARY KEY,"
+            " path TEXT NOT NULL,"
+            " size INTEGER,"
+            " extension TEXT,"
+            " resolution TEXT,"
+            " seen_at REAL,"
+            " downloaded_at REAL,"
+            " sha256 TEXT)"
+        )
+        # 旧版本的索引没有 sha256 列
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(wallpapers)")}
+        if 'sha256' not in columns:
+            self.conn.execute("ALTER TABLE wallpapers ADD COLUMN sha256 TEXT")
+        self.conn.commit()
+
+    def lookup(self, wallpaper_ids):
+        """批量查询已下载的壁纸，返回 {id: path}"""
+        wallpaper_ids = list(set(wallpaper_ids))
+        found = {}
+        # SQLite 单条语句的参数个数有限制，分批查询
+        with self._lock:
+            for i in range(0, len(wallpaper_ids), 500):
+                batch = wallpaper_ids[i:i + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = self.conn.execute(f"SELECT id, path FROM wallpapers WHERE id IN ({placeholders})", batch)
+                found.update(rows.fetchall())
+        return found
+
+    def touch(self, wallpaper_ids):
+        """更新壁纸最近一次在列表页中出现的时间"""
+        now = time.time()
+        with self._lock:
+            self.conn.executemany("UPDATE wallpapers SET seen_at = ? WHERE id = ?", [(now, wid) for wid in wallpaper_ids])
+            self.conn.commit()
+
+    def record_download(self, wallpaper_id, path, size, extension, resolution, sha256=None):
+        """记录下载完成的壁纸"""
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO wallpapers (id, path, size, extension, resolution, seen_at, downloaded_at, sha256)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (wallpaper_id, path, size, extension, resolution, now, now, sha256)
+            )
+            self.conn.commit()
+
+    def forget(self, wallpaper_id):
+        """删除索引中已失效的记录"""
+        with self._lock:
+            self.conn.execute("DELETE FROM wallpapers WHERE id = ?", (wallpaper_id,))
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class CrawlJournal:
+    """爬取任务日志，记录已完成的列表页和每个壁纸的下载状态，用于中断后续传"""
+
+    def __init__(self, db_path):
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = connect_sqlite(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS journal_pages ("
+            " job TEXT NOT NULL,"
+            " page INTEGER NOT NULL,"
+            " completed_at REAL,"
+            " PRIMARY KEY (job, page))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS journal_downloads ("
+            " job TEXT NOT NULL,"
+            " id TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " record TEXT NOT NULL,"
+            " updated_at REAL,"
+            " PRIMARY KEY (job, id))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS journal_jobs ("
+            " job TEXT PRIMARY KEY,"
+            " seed TEXT NOT NULL)"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def job_key(category, params, listing_backend):
+        """根据类别和查询参数生成任务标识，相同条件的任务共享同一份日志"""
+        payload = json.dumps([category, params or {}, listing_backend], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def completed_pages(self, job):
+        """返回任务中已完成的页码集合"""
+        with self._lock:
+            rows = self.conn.execute("SELECT page FROM journal_pages WHERE job = ?", (job,))
+            return {row[0] for row in rows}
+
+    def record_page(self, job, page_num, wallpapers):
+        """记录一页已完成，并把该页的壁纸登记为待下载"""
+        now = time.time()
+        with self._lock:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO journal_downloads (job, id, status, record, updated_at) VALUES (?, ?, 'pending', ?, ?)",
+                    [(job, wp['id'], json.dumps(wp.to_dict(), ensure_ascii=False), now) for wp in wallpapers]
+                )
+                self.conn.execute("INSERT OR REPLACE INTO journal_pages (job, page, completed_at) VALUES (?, ?, ?)", (job, page_num, now))
+
+    def record_result(self, job, wallpaper_id, success):
+        """记录单个壁纸的下载结果"""
+        with self._lock:
+            with self.conn:
+                self.conn.execute(
+                    "UPDATE journal_downloads SET status = ?, updated_at = ? WHERE job = ? AND id = ?",
+                    ('done' if success else 'failed', time.time(), job, wallpaper_id)
+                )
+
+    def pending_wallpapers(self, job):
+        """返回任务中尚未下载成功的壁纸（待下载和下载失败的）"""
+        with self._lock:
+            rows = self.conn.execute("SELECT record FROM journal_downloads WHERE job = ? AND status != 'done'", (job,))
+            return [json.loads(row[0]) for row in rows]
+
+    def job_seed(self, job, seed):
+        """返回任务的随机排序种子：第一次运行时保存传入的种子，续传时沿用保存的种子"""
+        with self._lock:
+            with self.conn:
+                self.conn.execute("INSERT OR IGNORE INTO journal_jobs (job, seed) VALUES (?, ?)", (job, seed))
+                return self.conn.execute("SELECT seed FROM journal_jobs WHERE job = ?", (job,)).fetchone()[0]
+
+    def finish(self, job):
+        """任务全部完成后清除日志，下一次相同任务重新开始"""
+        with self._lock:
+            with self.conn:
+                self.conn.execute("DELETE FROM journal_jobs WHERE job = ?", (job,))
+                self.conn.execute("DELETE FROM journal_pages WHERE job = ?", (job,))
+                self.conn.execute("DELETE FROM journal_downloads WHERE job = ?", (job,))
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class ResponseCache:
+    """列表页和详情页的本地响应缓存，保存解析后的结果，按最近访问时间淘汰（LRU）"""
+
+    def __init__(self, db_path, max_bytes):
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.conn = connect_sqlite(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS http_cache ("
+            " key TEXT PRIMARY KEY,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " body_size INTEGER,"
+            " parsed TEXT NOT NULL,"
+            " stored_at REAL,"
+            " accessed_at REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS http_cache_accessed ON http_cache (accessed_at)")
+        self.conn.commit()
+        # 缓存总大小在内存中累计，只在打开时统计一次，避免每次写入都扫描整张表
+        self.total_size = self.conn.execute("SELECT COALESCE(SUM(LENGTH(parsed)), 0) FROM http_cache").fetchone()[0]
+
+    @staticmethod
+    def make_key(url, params):
+        """根据URL和排序后的查询参数生成缓存键"""
+        return url + '?' + json.dumps(params or {}, sort_keys=True, ensure_ascii=False)
+
+    def get(self, key):
+        """读取缓存条目并更新访问时间，不存在时返回 None"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT etag, last_modified, body_size, parsed, stored_at FROM http_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            with self.conn:
+                self.conn.execute("UPDATE http_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        etag, last_modified, body_size, parsed, stored_at = row
+        return {
+            'etag': etag,
+            'last_modified': last_modified,
+            'body_size': body_size,
+            'parsed': json.loads(parsed),
+            'stored_at': stored_at
+        }
+
+    def refresh(self, key):
+        """服务器返回 304 时刷新缓存条目的保存时间"""
+        now = time.time()
+        with self._lock:
+            with self.conn:
+                self.conn.execute("UPDATE http_cache SET stored_at = ?, accessed_at = ? WHERE key = ?", (now, now, key))
+
+    def put(self, key, etag, last_modified, body_size, parsed):
+        """保存解析结果，超过容量上限时淘汰最久未访问的条目"""
+        now = time.time()
+        parsed = json.dumps(parsed, ensure_ascii=False, default=Wallpaper.to_dict)
+        with self._lock:
+            with self.conn:
+                replaced = self.conn.execute("SELECT LENGTH(parsed) FROM http_cache WHERE key = ?", (key,)).fetchone()
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO http_cache (key, etag, last_modified, body_size, parsed, stored_at, accessed_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, etag, last_modified, body_size, parsed, now, now)
+                )
+                self.total_size += len(parsed) - (replaced[0] if replaced else 0)
+                if self.total_size > self.max_bytes:
+                    self._evict()
+
+    def _evict(self):
+        # 其他进程可能也写入了同一个缓存，淘汰前重新统计实际大小
+        total = self.conn.execute("SELECT COALESCE(SUM(LENGTH(parsed)), 0) FROM http_cache").fetchone()[0]
+        self.total_size = total
+        if total <= self.max_bytes:
+            return
+        # 一次淘汰到容量的 90%，缓存满了以后不会每次写入都触发淘汰
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute("SELECT key, LENGTH(parsed) FROM http_cache ORDER BY accessed_at")
+        evicted = []
+        for key, size in rows:
+            if total <= target:
+                break
+            evicted.append((key,))
+            total -= size
+        self.conn.executemany("DELETE FROM http_cache WHERE key = ?", evicted)
+        self.total_size = total
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class SyncState:
+    """同步模式的状态：每个查询保存最近见过的壁纸 ID（高水位标记）和上次下载失败、需要重试的壁纸"""
+
+    # 每个查询保存的标记数量，最新的几张被删除后仍能找到停止位置
+    MAX_MARKS = 64
+
+    def __init__(self, db_path):
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = connect_sqlite(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sync_state ("
+            " query TEXT PRIMARY KEY,"
+            " marks TEXT NOT NULL,"
+            " pending TEXT NOT NULL,"
+            " synced_at REAL,"
+            " syncs INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def query_key(category, params):
+        """根据类别和查询参数生成查询标识"""
+        return json.dumps([category, params or {}], sort_keys=True, ensure_ascii=False)
+
+    def load(self, query):
+        """读取查询的同步状态，从未同步过时返回 None"""
+        with self._lock:
+            row = self.conn.execute("SELECT marks, pending, synced_at, syncs FROM sync_state WHERE query = ?", (query,)).fetchone()
+        if row is None:
+            return None
+        marks, pending, synced_at, syncs = row
+        return {'marks': json.loads(marks), 'pending': json.loads(pending), 'synced_at': synced_at, 'syncs': syncs}
+
+    def save(self, query, marks, pending):
+        """保存一次同步的结果，marks 按从新到旧排列"""
+        with self._lock:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT INTO sync_state (query, marks, pending, synced_at, syncs) VALUES (?, ?, ?, ?, 1)"
+                    " ON CONFLICT(query) DO UPDATE SET marks = excluded.marks, pending = excluded.pending,"
+                    " synced_at = excluded.synced_at, syncs = syncs + 1",
+                    (query, json.dumps(marks[:self.MAX_MARKS]), json.dumps(pending, ensure_ascii=False), time.time())
+                )
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class WorkQueue:
+    """多进程、多主机共享的 SQLite 工作队列
+
+    协调进程把列表页登记为任务，工作进程按批领取（带租约），解析出的壁纸再作为下载任务放回队列，
+    同一个壁纸只会登记一次。工作进程崩溃或失联时租约过期，任务会被其他工作进程重新领取。
+    各工作进程定期写回进度，供协调进程汇总显示。
+    """
+
+    def __init__(self, db_path, lease_seconds=300, max_attempts=3):
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # 手动管理事务，领取任务时用 BEGIN IMMEDIATE 在多个进程之间加写锁
+        self.conn = connect_sqlite(db_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS queue_jobs ("
+            " job TEXT PRIMARY KEY,"
+            " category TEXT NOT NULL,"
+            " params TEXT NOT NULL,"
+            " listing_backend TEXT NOT NULL,"
+            " output TEXT,"
+            " download INTEGER NOT NULL,"
+            " created_at REAL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS queue_items ("
+            " job TEXT NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " payload TEXT,"
+            " status TEXT NOT NULL,"
+            " worker TEXT,"
+            " lease_until REAL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " updated_at REAL,"
+            " PRIMARY KEY (job, kind, key))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS queue_items_status ON queue_items (kind, status)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS queue_workers ("
+            " worker TEXT PRIMARY KEY,"
+            " progress TEXT NOT NULL,"
+            " heartbeat_at REAL)"
+        )
+
+    @contextmanager
+    def transaction(self):
+        """写事务，开始时即获取数据库写锁"""
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def add_job(self, job, category, params, listing_backend, output, download, page_numbers):
+        """登记任务和它的列表页；相同任务未完成时保留进度续传，已全部完成时重新开始"""
+        now = time.time()
+        with self.transaction() as conn:
+            known = conn.execute("SELECT params FROM queue_jobs WHERE job = ?", (job,)).fetchone()
+            unfinished = conn.execute("SELECT 1 FROM queue_items WHERE job = ? AND status IN ('pending', 'claimed') LIMIT 1", (job,)).fetchone()
+            if known and not unfinished:
+                conn.execute("DELETE FROM queue_items WHERE job = ?", (job,))
+            elif known:
+                # 未完成的任务沿用原来的查询参数，随机排序的种子不变
+                params = json.loads(known[0])
+            conn.execute(
+                "INSERT OR REPLACE INTO queue_jobs (job, category, params, listing_backend, output, download, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job, category, json.dumps(params, ensure_ascii=False), listing_backend, output, int(download), now)
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO queue_items (job, kind, key, status, updated_at) VALUES (?, 'page', ?, 'pending', ?)",
+                [(job, str(page_num), now) for page_num in page_numbers]
+            )
+
+    def job_info(self, job):
+        """读取任务的类别、查询参数和下载目录"""
+        with self._lock:
+            row = self.conn.execute("SELECT category, params, listing_backend, output, download FROM queue_jobs WHERE job = ?", (job,)).fetchone()
+        category, params, listing_backend, output, download = row
+        return {'category': category, 'params': json.loads(params), 'listing_backend': listing_backend, 'output': output, 'download': bool(download)}
+
+    def claim(self, worker, page_batch, download_batch):
+        """领取一批同类任务，返回 (类别, [(任务, 键, 内容)])
+
+        优先领取下载任务，使待下载的积压保持在较小规模；租约过期的任务视为无人处理。
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            for kind, limit in (('download', download_batch), ('page', page_batch)):
+                rows = conn.execute(
+                    "SELECT job, key, payload FROM queue_items WHERE kind = ?"
+                    " AND (status = 'pending' OR (status = 'claimed' AND lease_until < ?)) ORDER BY rowid LIMIT ?",
+                    (kind, now, limit)
+                ).fetchall()
+                if rows:
+                    conn.executemany(
+                        "UPDATE queue_items SET status = 'claimed', worker = ?, lease_until = ?, attempts = attempts + 1, updated_at = ?"
+                        " WHERE job = ? AND kind = ? AND key = ?",
+                        [(worker, now + self.lease_seconds, now, job, kind, key) for job, key, _ in rows]
+                    )
+                    return kind, rows
+        return None, []
+
+    def record_page(self, job, page_num, wallpapers):
+        """记录一页已完成，并把该页的壁纸登记为下载任务"""
+        now = time.time()
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO queue_items (job, kind, key, payload, status, updated_at) VALUES (?, 'download', ?, ?, 'pending', ?)",
+                [(job, wp['id'], json.dumps(wp.to_dict(), ensure_ascii=False), now) for wp in wallpapers]
+            )
+            conn.execute("UPDATE queue_items SET status = 'done', lease_until = NULL, updated_at = ? WHERE job = ? AND kind = 'page' AND key = ?",
+                         (now, job, str(page_num)))
+
+    def record_result(self, job, kind, key, success):
+        """记录任务结果，失败的任务在未超过最大尝试次数时放回队列"""
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE queue_items SET status = CASE WHEN ? THEN 'done' WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,"
+                " lease_until = NULL, updated_at = ? WHERE job = ? AND kind = ? AND key = ?",
+                (bool(success), self.max_attempts, time.time(), job, kind, str(key))
+            )
+
+    def release(self, worker):
+        """工作进程退出时把它持有的任务放回队列，不计入尝试次数"""
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE queue_items SET status = 'pending', lease_until = NULL, attempts = MAX(0, attempts - 1)"
+                " WHERE worker = ? AND status = 'claimed'",
+                (worker,)
+            )
+
+    def heartbeat(self, worker, progress):
+        """为工作进程持有的任务续租，并写回它的进度"""
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute("UPDATE queue_items SET lease_until = ? WHERE worker = ? AND status = 'claimed'", (now + self.lease_seconds, worker))
+            conn.execute("INSERT OR REPLACE INTO queue_workers (worker, progress, heartbeat_at) VALUES (?, ?, ?)",
+                         (worker, json.dumps(progress, ensure_ascii=False), now))
+
+    def has_unfinished(self, jobs=None):
+        """队列中（或指定任务中）是否还有待处理或处理中的任务"""
+        query = "SELECT 1 FROM queue_items WHERE status IN ('pending', 'claimed')"
+        params = []
+        if jobs is not None:
+            query += f" AND job IN ({','.join('?' * len(jobs))})"
+            params = list(jobs)
+        with self._lock:
+            return self.conn.execute(query + " LIMIT 1", params).fetchone() is not None
+
+    def summary(self, job):
+        """按类别和状态统计任务数量，如 {'page': {'done': 3}, 'download': {'pending': 40}}"""
+        counts = {'page': {}, 'download': {}}
+        with self._lock:
+            rows = self.conn.execute("SELECT kind, status, COUNT(*) FROM queue_items WHERE job = ? GROUP BY kind, status", (job,))
+            for kind, status, count in rows:
+                counts[kind][status] = count
+        return counts
+
+    def workers(self):
+        """所有工作进程最近一次上报的进度，超过租约时长没有上报的运行中进程标记为 lost"""
+        with self._lock:
+            rows = self.conn.execute("SELECT worker, progress, heartbeat_at FROM queue_workers ORDER BY worker").fetchall()
+        now = time.time()
+        workers = []
+        for worker, progress, heartbeat_at in rows:
+            progress = dict(json.loads(progress), worker=worker, heartbeat_at=heartbeat_at)
+            if progress['status'] == 'running' and now - heartbeat_at > self.lease_seconds:
+                progress['status'] = 'lost'
+            workers.append(progress)
+        return workers
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class ResultExporter:
+    """把列表页结果逐页写入 JSONL / CSV / Parquet 文件，下游工具无需重新爬取即可处理
+
+    JSONL 和 CSV 追加写入已有文件，每页写完后刷新；Parquet 每页写入一个行组，关闭后文件才完整。
+    """
+
+    FORMATS = ('jsonl', 'csv', 'parquet')
+
+    def __init__(self, path):
+        self.path = path
+        self.format = os.path.splitext(path)[1].lower().lstrip('.')
+        if self.format not in self.FORMATS:
+            raise ValueError(f"不支持的导出格式: {path} (支持 .jsonl / .csv / .parquet)")
+        if self.format == 'parquet' and load_pyarrow() is None:
+            raise ValueError("导出 Parquet 需要安装 pyarrow (pip install pyarrow)")
+        self.rows = 0
+        self._file = None
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def write_page(self, category, page_num, wallpapers):
+        """写入一页壁纸记录"""
+        import csv
+        now = time.time()
+        rows = [{
+            'id': wp['id'],
+            'category': category,
+            'page': page_num,
+            'url': wp.get('url'),
+            'download_url': wp.get('download_url'),
+            'thumb_url': wp.get('thumb_url'),
+            'extension': wp.get('extension'),
+            'resolution': wp.get('resolution'),
+            'file_size': wp.get('file_size'),
+            'purity': wp.get('purity'),
+            'tags': list(wp['tags']) if wp.get('tags') is not None else None,
+            'colors': list(wp['colors']) if wp.get('colors') is not None else None,
+            'crawled_at': now,
+        } for wp in wallpapers]
+
+        with self._lock:
+            if self.format == 'jsonl':
+                if self._file is None:
+                    self._file = open(self.path, 'a', encoding='utf-8')
+                self._file.write(''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows))
+                self._file.flush()
+            elif self.format == 'csv':
+                if self._file is None:
+                    write_header = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+                    self._file = open(self.path, 'a', encoding='utf-8', newline='')
+                    self._writer = csv.DictWriter(self._file, fieldnames=EXPORT_FIELDS)
+                    if write_header:
+                        self._writer.writeheader()
+                # CSV 中的标签和颜色用逗号连接
+                self._writer.writerows({**row, 'tags': ','.join(row['tags'] or []), 'colors': ','.join(row['colors'] or [])} for row in rows)
+                self._file.flush()
+            else:
+                schema = self.parquet_schema()
+                if self._writer is None:
+                    self._writer = load_pyarrow().parquet.ParquetWriter(self.path, schema)
+                self._writer.write_table(load_pyarrow().Table.from_pylist(rows, schema=schema))
+            self.rows += len(rows)
+
+    @staticmethod
+    def parquet_schema():
+        pyarrow = load_pyarrow()
+        string = pyarrow.string()
+        return pyarrow.schema([
+            ('id', string), ('category', string), ('page', pyarrow.int64()), ('url', string), ('download_url', string),
+            ('thumb_url', string), ('extension', string), ('resolution', string), ('file_size', pyarrow.int64()),
+            ('purity', string), ('tags', pyarrow.list_(string)), ('colors', pyarrow.list_(string)), ('crawled_at', pyarrow.float64()),
+        ])
+
+    def close(self):
+        with self._lock:
+            if self.format == 'parquet':
+                if self._writer is not None:
+                    self._writer.close()
+            elif self._file is not None:
+                self._file.close()
+            self._file = None
+            self._writer = None
+
+
+class Metrics:
+    """运行指标：计数器、仪表和直方图，可导出为 JSON 摘要或 Prometheus 文本格式"""
+
+    # 直方图桶上限（秒），覆盖从毫秒级解析到分钟级大文件下载
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    # Prometheus 导出时每个指标族的 # HELP 说明，未列出的指标使用通用说明
+    HELP = {
+        'responses': "按状态码统计的 HTTP 响应数",
+        'retries': "请求重试次数",
+        'throttled': "被限流 (429) 的请求数",
+        'cache_hits': "响应缓存命中次数",
+        'cache_misses': "响应缓存未命中次数",
+        'cache_bytes_saved': "因缓存命中省下的响应字节数",
+        'details_fetched': "成功获取的详情页数",
+        'details_failed': "获取失败的详情页数",
+        'details_skipped': "已有详情而跳过的壁纸数",
+        'downloaded_bytes': "写入磁盘的下载字节数",
+        'disk_writes': "磁盘写入次数",
+        'disk_fsyncs': "fsync 次数",
+        'dedup_files': "从已下载文件复制而免于下载的文件数",
+        'dedup_bytes': "从已下载文件复制的字节数",
+        'corrupt_files': "校验失败被删除的文件数",
+        'extension_fixed': "纠正了扩展名的壁纸数",
+        'wasted_requests': "因扩展名猜错而浪费的请求数",
+        'stream_queue_depth': "流式模式下等待下载的壁纸数",
+        'request_seconds': "单个 HTTP 请求耗时（秒）",
+        'fetch_seconds': "获取页面耗时（秒）",
+        'parse_seconds': "解析页面耗时（秒）",
+        'download_seconds': "单个文件下载耗时（秒）",
+        'disk_write_seconds': "单个文件写盘耗时（秒）",
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items())) if labels else ()
+
+    def inc(self, name, amount=1, **labels):
+        """累加计数器"""
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        """设置仪表的当前值"""
+        with self._lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        """记录一次直方图观测值"""
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * (len(self.BUCKETS) + 1), 'count': 0, 'sum': 0.0, 'max': 0.0}
+            histogram['buckets'][bisect.bisect_left(self.BUCKETS, value)] += 1
+            histogram['count'] += 1
+            histogram['sum'] += value
+            histogram['max'] = max(histogram['max'], value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """统计代码块耗时的上下文管理器"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def quantile(self, histogram, q):
+        """根据桶分布估算分位数"""
+        if histogram['count'] == 0:
+            return 0.0
+        rank = q * histogram['count']
+        seen = 0
+        lower = 0.0
+        for upper, count in zip(self.BUCKETS + (histogram['max'],), histogram['buckets']):
+            if count and seen + count >= rank:
+                upper = min(upper, histogram['max'])
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return histogram['max']
+
+    @staticmethod
+    def _label_text(labels):
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+    def to_dict(self):
+        """导出 JSON 摘要"""
+        with self._lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = {key: dict(value, buckets=list(value['buckets'])) for key, value in self.histograms.items()}
+
+        def name_of(key):
+            return key[0] + self._label_text(key[1])
+
+        elapsed = time.time() - self.started_at
+        summary = {
+            'elapsed_seconds': round(elapsed, 3),
+            'counters': {name_of(key): value for key, value in sorted(counters.items())},
+            'gauges': {name_of(key): value for key, value in sorted(gauges.items())},
+            'histograms': {},
+        }
+        for key, histogram in sorted(histograms.items()):
+            count = histogram['count']
+            summary['histograms'][name_of(key)] = {
+                'count': count,
+                'sum': round(histogram['sum'], 6),
+                'mean': round(histogram['sum'] / count, 6) if count else 0.0,
+                'p50': round(self.quantile(histogram, 0.5), 6),
+                'p90': round(self.quantile(histogram, 0.9), 6),
+                'p99': round(self.quantile(histogram, 0.99), 6),
+                'max': round(histogram['max'], 6),
+            }
+        downloaded = sum(value for key, value in counters.items() if key[0] == 'downloaded_bytes')
+        summary['download_bytes_per_second'] = round(downloaded / elapsed, 1) if elapsed > 0 else 0.0
+        return summary
+
+    def to_prometheus(self):
+        """导出 Prometheus 文本格式"""
+        lines = []
+        described = set()
+
+        def describe(name, family, kind):
+            # 同名指标的不同标签组合按顺序相邻，每个指标族只输出一次 HELP 和 TYPE
+            if family not in described:
+                described.add(family)
+                lines.append(f"# HELP {family} {self.HELP.get(name, name.replace('_', ' '))}")
+                lines.append(f"# TYPE {family} {kind}")
+
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                describe(name, f"wallhaven_{name}_total", 'counter')
+                lines.append(f"wallhaven_{name}_total{self._label_text(labels)} {value}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                describe(name, f"wallhaven_{name}", 'gauge')
+                lines.append(f"wallhaven_{name}{self._label_text(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                describe(name, f"wallhaven_{name}", 'histogram')
+                cumulative = 0
+                for upper, count in zip(self.BUCKETS + ('+Inf',), histogram['buckets']):
+                    cumulative += count
+                    bucket_labels = labels + (('le', upper),)
+                    lines.append(f"wallhaven_{name}_bucket{self._label_text(bucket_labels)} {cumulative}")
+                lines.append(f"wallhaven_{name}_sum{self._label_text(labels)} {histogram['sum']}")
+                lines.append(f"wallhaven_{name}_count{self._label_text(labels)} {histogram['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """写入指标文件，.prom 后缀使用 Prometheus 文本格式，其他使用 JSON"""
+        if path.endswith('.prom'):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def serve(self, port, host='127.0.0.1'):
+        """在后台线程中提供 /metrics HTTP 端点，默认只监听本机"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+class PlainConsole:
+    """不依赖 rich 的纯文本输出，去掉样式标记后直接写入，定时任务等短时运行时不必导入 rich"""
+
+    MARKUP_PATTERN = re.compile(r'\[(?:/|/?(?:bold |dim )?(?:red|yellow|green|cyan|blue|magenta|white|bold|dim))\]')
+
+    def __init__(self, stderr=False, quiet=False):
+        self.stderr = stderr
+        self.quiet = quiet
+        self._lock = threading.Lock()
+
+    def print(self, *objects, sep=' ', end='\n', **kwargs):
+        if self.quiet:
+            return
+        text = self.MARKUP_PATTERN.sub('', sep.join(str(obj) for obj in objects))
+        file = sys.stderr if self.stderr else sys.stdout
+        # 多个下载线程同时输出时整行写入，避免行与行交错
+        with self._lock:
+            file.write(text + end)
+            file.flush()
+
+
+class PlainProgress:
+    """纯文本模式下的进度条替代对象，接口与 rich.progress.Progress 相同但不输出任何内容"""
+
+    def __init__(self):
+        self.tasks = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add_task(self, description='', total=None, **kwargs):
+        self.tasks += 1
+        return self.tasks - 1
+
+    def update(self, task_id, **kwargs):
+        pass
+
+
+def create_console(plain=False, stderr=False):
+    """创建输出控制台，plain 为 True 时使用纯文本输出，不导入 rich"""
+    if plain:
+        return PlainConsole(stderr=stderr)
+    from rich.console import Console
+    return Console(stderr=stderr)
 
 
 class WallhavenSpider:
-    def __init__(self, config_file='config.json'):
+    def __init__(self, config_file='config.json', console=None):
         self.base_url = "https://wallhaven.cc"
+        self.image_base_url = "https://w.wallhaven.cc"
+        self.api_url = "https://wallhaven.cc/api/v1"
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         })
-        self.console = Console()
+        self.console = console or create_console()
         self.load_config(config_file)
+        # API 密钥通过请求头发送，避免出现在URL和日志中
+        if self.config['api_key']:
+            self.session.headers['X-API-Key'] = self.config['api_key']
+        # 连接池大小与并发线程数匹配，避免超过默认10个连接后线程争抢连接
+        pool_size = max(self.config.get('max_threads', 5), self.config['max_page_workers'], 10)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # 每个主机一个自适应速率限制器，所有线程和所有请求路径共享
+        self.rate_limiters = {}
+        self._limiters_lock = threading.Lock()
+        self._async_fallback_warned = False
+        # 已确认的壁纸扩展名缓存，以及本次运行的统计数据
+        self.extension_cache = {}
+        # 详情页结果按壁纸 ID 记忆，保存的是 Future，同一壁纸的详情页只请求一次
+        self.details_memo = {}
+        self._details_lock = threading.Lock()
+        self.details_executor = None
+        # 下载时计算的文件 SHA-256，写入索引后删除
+        self.file_hashes = {}
+        # 每个下载线程复用的读取缓冲区
+        self._download_buffers = threading.local()
+        self.run_stats = {}
+        self._stats_lock = threading.Lock()
+        # 列表页结果导出，每解析完一页就写入
+        self.exporter = ResultExporter(self.config['export_file']) if self.config['export_file'] else None
+
+        # 全局下载带宽限制（KB/秒），0 表示不限制
+        self.bandwidth = BandwidthLimiter(self.config['bandwidth_limit'] * 1024) if self.config['bandwidth_limit'] > 0 else None
+
+        # 运行指标，可在运行结束时写入文件或通过 HTTP 端点导出
+        self.metrics = Metrics()
+        if self.config['metrics_port']:
+            try:
+                self.metrics.serve(self.config['metrics_port'], self.config['metrics_host'])
+            except OSError as e:
+                self.console.print(f"[yellow]无法启动指标端点 (端口 {self.config['metrics_port']}): {e}[/yellow]")
+        # 已下载壁纸索引、爬取任务日志和响应缓存，默认保存在下载目录中，第一次使用时才打开数据库
+        self.index_file = self.config['index_file'] or os.path.join(self.config['download_dir'], 'wallhaven_index.db')
+        self._databases = {}
+        self._databases_lock = threading.Lock()
         # 初始化中断标志
         self.interrupted = False
         # 注册信号处理器
         signal.signal(signal.SIGINT, self.signal_handler)
         
+    def open_database(self, name, create):
+        """按需打开共享索引文件中的一个数据库，多个线程同时第一次使用时只打开一次"""
+        if name not in self._databases:
+            with self._databases_lock:
+                if name not in self._databases:
+                    self._databases[name] = create()
+        return self._databases[name]
+
+    @property
+    def index(self):
+        """已下载壁纸索引，未启用时为 None"""
+        return self.open_database('index', lambda: WallpaperIndex(self.index_file) if self.config['use_index'] else None)
+
+    @property
+    def journal(self):
+        """爬取任务日志，未启用时为 None"""
+        return self.open_database('journal', lambda: CrawlJournal(self.index_file) if self.config['use_journal'] else None)
+
+    @property
+    def cache(self):
+        """列表页和详情页的响应缓存，未启用时为 None"""
+        return self.open_database('cache', lambda: ResponseCache(self.index_file, self.config['cache_max_mb'] * 1024 * 1024)
+                                  if self.config['use_cache'] else None)
+
+    @property
+    def sync_state(self):
+        """同步模式的状态，第一次同步时才打开"""
+        return self.open_database('sync_state', lambda: SyncState(self.index_file))
+
     def signal_handler(self, signum, frame):
         """信号处理器，用于处理 Ctrl+C 中断"""
         self.interrupted = True
         raise KeyboardInterrupt("程序被用户中断")
 
+    def create_progress(self, counter='percent'):
+        """创建进度条，counter 为 percent (百分比)、count (完成数/总数) 或 None (只显示描述)；纯文本输出时不显示进度"""
+        if isinstance(self.console, PlainConsole):
+            return PlainProgress()
+        from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn
+        columns = [SpinnerColumn(), TextColumn("[progress.description]{task.description}")]
+        if counter == 'percent':
+            columns += [BarColumn(), TextColumn("[progress.percentage]{task.percentage:>3.0f}%")]
+        elif counter == 'count':
+            columns += [BarColumn(), TextColumn("{task.completed}/{task.total}")]
+        return Progress(*columns, console=self.console)
+
     def load_config(self, config_file):
         """加载配置文件"""
         try:
             with open(config_file, 'r', encoding='utf-8') as f:
-                self.config = json.load(f)
+                # 旧配置文件缺少的新配置项使用默认值补齐
+                self.config = {**DEFAULT_CONFIG, **json.load(f)}
         except FileNotFoundError:
             self.console.print(f"[yellow]配置文件 {config_file} 未找到，使用默认配置[/yellow]")
-            self.config = {
-                "download_dir": "downloads",
-                "delay_between_requests": 1,
-                "max_pages_per_session": 10,
-                "image_formats": ["jpg", "jpeg", "png", "gif", "webp"],
-                "max_retries": 3,
-                "timeout": 30
-            }
+            self.config = dict(DEFAULT_CONFIG)
         except json.JSONDecodeError:
             self.console.print(f"[red]配置文件 {config_file} 格式错误，使用默认配置[/red]")
-            self.config = {
-                "download_dir": "downloads",
-                "delay_between_requests": 1,
-                "max_pages_per_session": 10,
-                "image_formats": ["jpg", "jpeg", "png", "gif", "webp"],
-                "max_retries": 3,
-                "timeout": 30
-            }
+            self.config = dict(DEFAULT_CONFIG)
 
     def get_time_range_filter(self):
         """获取时间范围筛选参数"""
+        from rich.prompt import Prompt
         print("\n请选择时间范围筛选:")
         print("1. 全部时间 (all time)")
         print("2. 最近一天 (1 day)")
@@ -99,6 +1528,7 @@ class WallhavenSpider:
 
     def get_resolution_filter(self):
         """获取分辨率筛选参数"""
+        from rich.prompt import Prompt
         print("\n请选择分辨率筛选:")
         print("1. 自定义分辨率 (custom)")
         print("2. 1920x1080 (1080p)")
@@ -131,6 +1561,7 @@ class WallhavenSpider:
 
     def get_page_range(self):
         """询问用户要爬取的页面范围"""
+        from rich.prompt import Prompt
         print("\n请选择页面范围:")
         print("1. 单页 (例如: 第1页)")
         print("2. 多页 (例如: 第1-5页)")
@@ -192,10 +1623,138 @@ class WallhavenSpider:
         # 这里简化处理，返回常见格式之一
         return 'jpg'
 
-    def get_wallpapers_from_page(self, category, page_num, params=None):
-        """从指定页面获取壁纸列表"""
-        if params is None:
-            params = {}
+    def limiter_for(self, url):
+        """获取URL所在主机的速率限制器"""
+        host = urlparse(url).netloc
+        with self._limiters_lock:
+            limiter = self.rate_limiters.get(host)
+            if limiter is None:
+                delay = self.config['delay_between_requests']
+                max_rate = self.config['max_requests_per_second']
+                limiter = RateLimiter(1.0 / delay if delay > 0 else max_rate, max_rate)
+                self.rate_limiters[host] = limiter
+            return limiter
+
+    def parse_retry_after(self, value):
+        """解析 Retry-After 响应头，支持秒数和HTTP日期两种格式"""
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def backoff_delay(self, attempt):
+        """带随机抖动的指数退避时间"""
+        cap = min(self.config['retry_backoff_max'], self.config['retry_backoff'] * (2 ** attempt))
+        return random.uniform(cap / 2, cap)
+
+    def request(self, method, url, **kwargs):
+        """所有HTTP请求的统一入口：经过速率限制器，限流或服务器错误时退避重试"""
+        limiter = self.limiter_for(url)
+        kwargs.setdefault('timeout', self.config['timeout'])
+        max_retries = self.config['max_retries']
+
+        host = urlparse(url).netloc
+        for attempt in range(max_retries + 1):
+            limiter.acquire()
+            try:
+                with self.metrics.timer('request_seconds', method=method, host=host):
+                    response = self.session.request(method, url, **kwargs)
+                self.metrics.inc('responses', status=response.status_code)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt >= max_retries:
+                    raise
+                self.count_stat('retries')
+                time.sleep(self.backoff_delay(attempt))
+                continue
+
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= max_retries:
+                if response.status_code == 429:
+                    limiter.on_throttle(self.parse_retry_after(response.headers.get('Retry-After')))
+                    self.count_stat('throttled')
+                elif response.status_code < 400:
+                    limiter.on_success()
+                return response
+
+            response.close()
+            self.count_stat('retries')
+            if response.status_code == 429:
+                # 限流时全局暂停，由速率限制器在下一次 acquire 时等待
+                self.count_stat('throttled')
+                retry_after = self.parse_retry_after(response.headers.get('Retry-After'))
+                limiter.on_throttle(retry_after)
+                if retry_after is None:
+                    time.sleep(self.backoff_delay(attempt))
+            else:
+                time.sleep(self.backoff_delay(attempt))
+
+    def cache_ttl(self, cache_category, params=None):
+        """返回缓存有效期（秒），toplist 可按时间范围单独配置，如 toplist:1y"""
+        ttl_config = self.config['cache_ttl']
+        top_range = (params or {}).get('topRange')
+        if top_range and f"{cache_category}:{top_range}" in ttl_config:
+            return ttl_config[f"{cache_category}:{top_range}"]
+        return ttl_config.get(cache_category, 0)
+
+    def fetch_parsed(self, url, params, cache_category, parse, revalidate=False):
+        """获取并解析页面，有效期内直接使用缓存的解析结果，过期后用 ETag/Last-Modified 重新验证
+
+        revalidate 为 True 时即使缓存未过期也向服务器重新验证，用于必须看到最新内容的同步模式。
+        """
+        ttl = self.cache_ttl(cache_category, params)
+        phase = self.metrics_phase(cache_category)
+        if self.cache is None or ttl <= 0:
+            with self.metrics.timer('fetch_seconds', phase=phase):
+                response = self.request('GET', url, params=params)
+            response.raise_for_status()
+            with self.metrics.timer('parse_seconds', phase=phase):
+                return parse(response.text)
+
+        key = ResponseCache.make_key(url, params)
+        entry = self.cache.get(key)
+        if entry is not None and not revalidate and time.time() - entry['stored_at'] < ttl:
+            self.count_cache_hit(entry)
+            return entry['parsed']
+
+        headers = {}
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        with self.metrics.timer('fetch_seconds', phase=phase):
+            response = self.request('GET', url, params=params, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            self.cache.refresh(key)
+            self.count_cache_hit(entry)
+            return entry['parsed']
+        response.raise_for_status()
+
+        with self.metrics.timer('parse_seconds', phase=phase):
+            parsed = parse(response.text)
+        self.count_stat('cache_misses')
+        if parsed:
+            self.cache.put(key, response.headers.get('ETag'), response.headers.get('Last-Modified'), len(response.content), parsed)
+        return parsed
+
+    @staticmethod
+    def metrics_phase(cache_category):
+        """把缓存类别映射为指标中的阶段名"""
+        return 'detail' if cache_category == 'details' else 'listing'
+
+    def count_cache_hit(self, entry):
+        """记录一次缓存命中和节省的下载字节数"""
+        self.count_stat('cache_hits')
+        self.count_stat('cache_bytes_saved', entry['body_size'] or 0)
+
+    def build_listing_request(self, category, page_num, params=None):
+        """构建列表页请求的URL和查询参数"""
+        # 复制一份参数，避免并发获取多页时互相覆盖页码
+        params = dict(params) if params else {}
 
         if category == 'tag':
             url = f"{self.base_url}/search"
@@ -215,146 +1774,234 @@ class WallhavenSpider:
             url = f"{self.base_url}/search"
             params['page'] = page_num
 
-        try:
-            # 使用配置中的超时值
-            response = self.session.get(url, params=params, timeout=self.config['timeout'])
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            wallpapers = []
-            # 根据实际HTML结构，壁纸缩略图在ul.thumb-listing-page下的li元素中
-            list_items = soup.select('ul.thumb-listing-page li')
-
-            # 如果上面的选择器没找到，尝试其他可能的选择器
-            if not list_items:
-                list_items = soup.select('ul.thumb-listing li')
-            if not list_items:
-                list_items = soup.select('li')
-
-            for item in list_items:
-                # 从缩略图中提取信息
-                link_element = item.find('a')
-                if link_element and link_element.get('href'):
-                    wallpaper_url = link_element['href']
-
-                    # 确保壁纸URL是完整URL
-                    if wallpaper_url.startswith('/'):
-                        wallpaper_url = urljoin(self.base_url, wallpaper_url)
-
-                    # 重要：只处理wallhaven的壁纸链接，过滤掉其他链接
-                    if '/w/' not in wallpaper_url or not wallpaper_url.startswith(('http://', 'https://')):
-                        continue
-
-                    # 从缩略图中获取图片URL
-                    img_element = item.find('img')
-                    thumb_url = ''
-                    if img_element and img_element.get('data-src'):
-                        thumb_url = img_element['data-src']
-                    elif img_element and img_element.get('src'):
-                        thumb_url = img_element['src']
-
-                    # 从壁纸URL提取ID
-                    wallpaper_id = self.extract_wallpaper_id_from_url(wallpaper_url)
-
-                    # 尝试从缩略图的figure元素中查找扩展名信息
-                    # 根据提供的信息，扩展名在 span 标签中，如 <span class="png">PNG</span>
-                    figure_element = item.find('figure')
-                    extension = 'jpg'  # 默认扩展名
-
-                    if figure_element:
-                        # 查找包含扩展名的span标签，如 <span class="png">PNG</span>
-                        ext_spans = figure_element.find_all('span')
-                        for span in ext_spans:
-                            span_class = span.get('class', [])
-                            span_text = span.get_text(strip=True).lower()
-
-                            # 检查class属性是否包含常见的图片扩展名
-                            for cls in span_class:
-                                if cls.lower() in ['jpg', 'jpeg', 'png', 'gif', 'webp']:
-                                    extension = cls.lower()
-                                    break
-
-                            # 如果class中没有找到，也可以检查文本内容
-                            if extension == 'jpg':  # 如果还没找到扩展名
-                                if span_text in ['jpg', 'jpeg', 'png', 'gif', 'webp']:
-                                    extension = span_text
-
-                    # 根据Wallhaven的URL模式构建下载链接
-                    id_prefix = wallpaper_id[:2] if len(wallpaper_id) >= 2 else 'xx'
-                    download_url = f"https://w.wallhaven.cc/full/{id_prefix}/wallhaven-{wallpaper_id}.{extension}"
-
-                    # 尝试从缩略图旁边的信息中获取分辨率
-                    resolution = 'Unknown'
-                    # 查找可能包含分辨率信息的文本
-                    for text_node in item.find_all(string=True):
-                        res_match = re.search(r'(\d+)\s*x\s*(\d+)', str(text_node))
-                        if res_match:
-                            resolution = f"{res_match.group(1)} x {res_match.group(2)}"
-                            break
+        return url, params
 
-                    wallpapers.append({
-                        'id': wallpaper_id,
-                        'url': wallpaper_url,
-                        'thumb_url': thumb_url,
-                        'download_url': download_url,
-                        'extension': extension,
-                        'resolution': resolution,
-                        'size': 'Unknown'
-                    })
+    def build_api_request(self, category, page_num, params=None):
+        """构建 Wallhaven JSON API 搜索请求的URL和查询参数"""
+        params = dict(params) if params else {}
+        tag = params.pop('tag', None)
 
-            return wallpapers
+        if category == 'tag':
+            params['q'] = tag or ''
+        elif category == 'toplist':
+            params['sorting'] = 'toplist'
+        elif category == 'random':
+            params['sorting'] = 'random'
+        elif category == 'latest':
+            params['sorting'] = 'date_added'
+        params['page'] = page_num
+
+        return f"{self.api_url}/search", params
+
+    def build_page_request(self, category, page_num, params=None):
+        """根据配置的列表后端构建请求，返回 (URL, 查询参数, 解析函数)"""
+        if self.config['listing_backend'] == 'api':
+            url, params = self.build_api_request(category, page_num, params)
+            return url, params, self.parse_api_listing
+        url, params = self.build_listing_request(category, page_num, params)
+        return url, params, self.parse_listing_page
+
+    def new_random_seed(self):
+        """生成随机排序的种子，保证同一次爬取的多页结果不重复"""
+        return ''.join(random.choices(string.ascii_letters + string.digits, k=6))
+
+    def get_wallpapers_from_page(self, category, page_num, params=None, raise_errors=False, revalidate=False):
+        """从指定页面获取壁纸列表，raise_errors 为 True 时出错会继续抛出异常，便于区分空页和失败页"""
+        url, params, parse = self.build_page_request(category, page_num, params)
+
+        try:
+            return self.as_wallpapers(self.fetch_parsed(url, params, category, parse, revalidate=revalidate))
         except Exception as e:
             self.console.print(f"[red]获取页面 {page_num} 的壁纸时出错: {str(e)}[/red]")
+            if raise_errors:
+                raise
             return []
 
+    def parse_api_listing(self, json_text):
+        """解析 JSON API 搜索结果，生成与HTML列表页相同结构的壁纸记录"""
+        wallpapers = []
+        for item in json.loads(json_text).get('data', []):
+            download_url = item['path']
+            extension = self.parse_wallpaper_extension_from_filename(download_url)
+            resolution = item.get('resolution', '')
+            res_match = RESOLUTION_PATTERN.search(resolution)
+            resolution = f"{res_match.group(1)} x {res_match.group(2)}" if res_match else 'Unknown'
+
+            # API 返回的是准确的原图地址，不需要根据扩展名推测
+            wallpapers.append(self.build_wallpaper(item['id'], item['url'], item.get('thumbs', {}).get('small', ''), extension, resolution,
+                                                   file_size=item.get('file_size'), download_url=download_url,
+                                                   purity=item.get('purity'), colors=item.get('colors')))
+        return wallpapers
+
+    def parse_listing_page(self, html_text):
+        """解析列表页HTML，优先使用lxml快速解析，失败时回退到BeautifulSoup"""
+        if load_lxml() is not None:
+            try:
+                wallpapers = self.parse_listing_page_lxml(html_text)
+                if wallpapers:
+                    return wallpapers
+            except Exception:
+                pass
+        return self.parse_listing_page_bs4(html_text)
+
+    def parse_listing_page_lxml(self, html_text):
+        """使用lxml直接从 figure.thumb 结构中提取壁纸信息"""
+        tree = load_lxml().fromstring(html_text)
+        wallpapers = []
+
+        # 列表页中每个壁纸对应一个 <figure class="thumb" data-wallpaper-id="...">
+        for figure in tree.iter('figure'):
+            if 'thumb' not in (figure.get('class') or '').split():
+                continue
+
+            wallpaper_url = ''
+            thumb_url = ''
+            extension = 'jpg'  # 默认扩展名
+            resolution = 'Unknown'
+
+            for element in figure.iter('a', 'img', 'span'):
+                classes = (element.get('class') or '').split()
+                if element.tag == 'a':
+                    if 'preview' in classes and not wallpaper_url:
+                        wallpaper_url = element.get('href', '')
+                elif element.tag == 'img':
+                    if not thumb_url:
+                        thumb_url = element.get('data-src') or element.get('src') or ''
+                elif 'wall-res' in classes:
+                    res_match = RESOLUTION_PATTERN.search(element.text_content())
+                    if res_match:
+                        resolution = f"{res_match.group(1)} x {res_match.group(2)}"
+                else:
+                    # 扩展名在 span 标签中，如 <span class="png"><span>PNG</span></span>
+                    for cls in classes:
+                        if cls.lower() in IMAGE_EXTENSIONS:
+                            extension = cls.lower()
+
+            if not wallpaper_url:
+                continue
+            # 确保壁纸URL是完整URL
+            if wallpaper_url.startswith('/'):
+                wallpaper_url = urljoin(self.base_url, wallpaper_url)
+
+            wallpaper_id = figure.get('data-wallpaper-id') or self.extract_wallpaper_id_from_url(wallpaper_url)
+            wallpapers.append(self.build_wallpaper(wallpaper_id, wallpaper_url, thumb_url, extension, resolution,
+                                                   purity=self.parse_purity((figure.get('class') or '').split())))
+
+        return wallpapers
+
+    def parse_listing_page_bs4(self, html_text):
+        """使用BeautifulSoup解析列表页，兼容结构变化的页面"""
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html_text, 'html.parser')
+
+        wallpapers = []
+        # 根据实际HTML结构，壁纸缩略图在ul.thumb-listing-page下的li元素中
+        list_items = soup.select('ul.thumb-listing-page li')
+
+        # 如果上面的选择器没找到，尝试其他可能的选择器
+        if not list_items:
+            list_items = soup.select('ul.thumb-listing li')
+        if not list_items:
+            list_items = soup.select('li')
+
+        for item in list_items:
+            # 从缩略图中提取信息
+            link_element = item.find('a')
+            if link_element and link_element.get('href'):
+                wallpaper_url = link_element['href']
+
+                # 确保壁纸URL是完整URL
+                if wallpaper_url.startswith('/'):
+                    wallpaper_url = urljoin(self.base_url, wallpaper_url)
+
+                # 重要：只处理wallhaven的壁纸链接，过滤掉其他链接
+                if '/w/' not in wallpaper_url or not wallpaper_url.startswith(('http://', 'https://')):
+                    continue
+
+                # 从缩略图中获取图片URL
+                img_element = item.find('img')
+                thumb_url = ''
+                if img_element and img_element.get('data-src'):
+                    thumb_url = img_element['data-src']
+                elif img_element and img_element.get('src'):
+                    thumb_url = img_element['src']
+
+                # 从壁纸URL提取ID
+                wallpaper_id = self.extract_wallpaper_id_from_url(wallpaper_url)
+
+                # 尝试从缩略图的figure元素中查找扩展名信息
+                # 根据提供的信息，扩展名在 span 标签中，如 <span class="png">PNG</span>
+                figure_element = item.find('figure')
+                extension = 'jpg'  # 默认扩展名
+
+                if figure_element:
+                    # 查找包含扩展名的span标签，如 <span class="png">PNG</span>
+                    ext_spans = figure_element.find_all('span')
+                    for span in ext_spans:
+                        span_class = span.get('class', [])
+                        span_text = span.get_text(strip=True).lower()
+
+                        # 检查class属性是否包含常见的图片扩展名
+                        for cls in span_class:
+                            if cls.lower() in IMAGE_EXTENSIONS:
+                                extension = cls.lower()
+                                break
+
+                        # 如果class中没有找到，也可以检查文本内容
+                        if extension == 'jpg':  # 如果还没找到扩展名
+                            if span_text in IMAGE_EXTENSIONS:
+                                extension = span_text
+
+                # 尝试从缩略图旁边的信息中获取分辨率
+                resolution = 'Unknown'
+                # 查找可能包含分辨率信息的文本
+                for text_node in item.find_all(string=True):
+                    res_match = RESOLUTION_PATTERN.search(str(text_node))
+                    if res_match:
+                        resolution = f"{res_match.group(1)} x {res_match.group(2)}"
+                        break
+
+                purity = self.parse_purity(figure_element.get('class', [])) if figure_element else None
+                wallpapers.append(self.build_wallpaper(wallpaper_id, wallpaper_url, thumb_url, extension, resolution, purity=purity))
+
+        return wallpapers
+
+    @staticmethod
+    def parse_purity(classes):
+        """从 figure 的 class（如 thumb-sfw）中解析分级"""
+        for cls in classes:
+            if cls.startswith('thumb-') and cls[6:] in PURITIES:
+                return cls[6:]
+        return None
+
+    def build_download_url(self, wallpaper_id, extension):
+        """根据Wallhaven的URL模式构建下载链接"""
+        id_prefix = wallpaper_id[:2] if len(wallpaper_id) >= 2 else 'xx'
+        return f"{self.image_base_url}/full/{id_prefix}/wallhaven-{wallpaper_id}.{extension}"
+
+    def format_size(self, file_size):
+        """把字节数格式化为易读的文件大小"""
+        return format_size(file_size)
+
+    def build_wallpaper(self, wallpaper_id, wallpaper_url, thumb_url, extension, resolution, file_size=None, download_url=None,
+                        purity=None, colors=None):
+        """根据列表页信息构建壁纸记录"""
+        return Wallpaper(wallpaper_id, self.base_url, self.image_base_url, extension, resolution, file_size=file_size,
+                         url=wallpaper_url, thumb_url=thumb_url, download_url=download_url, purity=purity, colors=colors)
+
+    def as_wallpapers(self, records):
+        """把从缓存、日志或任务队列读出的 JSON 记录恢复为 Wallpaper 对象"""
+        return [record if isinstance(record, Wallpaper) else Wallpaper.from_dict(record, self.base_url, self.image_base_url)
+                for record in records]
+
     def get_wallpaper_details(self, wallpaper_url):
         """获取壁纸详细信息，包括真实下载链接和扩展名"""
         try:
-            # 添加延时以避免请求过于频繁
-            time.sleep(max(1, self.config['delay_between_requests']))  # 使用配置中的延迟时间，至少1秒
-            response = self.session.get(wallpaper_url, timeout=self.config['timeout'])
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            # 根据页面结构，查找壁纸图片的真实URL
-            # 壁纸图片通常在<main>标签内的<img>标签中
-            img_element = soup.select_one('main img[src*="wallhaven.cc"]')
-            if not img_element:
-                # 尝试其他可能的选择器
-                img_element = soup.select_one('img#wallpaper')
-
-            if img_element:
-                # 获取图片的真实URL
-                img_src = img_element.get('src') or img_element.get('data-src')
-                if img_src:
-                    # 确保URL是完整的
-                    if img_src.startswith('//'):
-                        img_src = 'https:' + img_src
-                    elif img_src.startswith('/'):
-                        img_src = urljoin(self.base_url, img_src)
-
-                    parsed = urlparse(img_src)
-                    filename = os.path.basename(parsed.path)
-                    wallpaper_id = filename.split('.')[0] if '.' in filename else self.extract_wallpaper_id_from_url(
-                        wallpaper_url)
-
-                    extension = self.parse_wallpaper_extension_from_filename(filename)
-
-                    # 查找分辨率信息
-                    resolution_elem = soup.select_one('h3')  # 分辨率通常在h3标签中
-                    resolution = resolution_elem.get_text().strip() if resolution_elem else 'Unknown'
-
-                    return {
-                        'id': wallpaper_id,
-                        'download_url': img_src,
-                        'extension': extension,
-                        'resolution': resolution
-                    }
-
+            # 请求频率由全局速率限制器控制，无需固定延时
+            return self.fetch_parsed(wallpaper_url, None, 'details', lambda html_text: self.parse_wallpaper_details(html_text, wallpaper_url))
         except requests.exceptions.HTTPError as e:
             if e.response.status_code == 429:
-                self.console.print(f"[yellow]请求过于频繁，暂停一段时间: {wallpaper_url}[/yellow]")
-                time.sleep(10)  # 如果被限制，则等待更长时间
+                self.console.print(f"[yellow]请求过于频繁，重试后仍被限流: {wallpaper_url}[/yellow]")
             elif e.response.status_code in [403, 404]:
                 self.console.print(f"[red]访问被拒绝或页面不存在: {wallpaper_url}[/red]")
             else:
@@ -366,6 +2013,152 @@ class WallhavenSpider:
 
         return None
 
+    def submit_details(self, wallpaper_id):
+        """提交详情页请求，返回 Future；同一壁纸只请求一次，失败的请求之后可以重试"""
+        from concurrent.futures import ThreadPoolExecutor
+        with self._details_lock:
+            future = self.details_memo.get(wallpaper_id)
+            if future is not None:
+                return future
+            if self.details_executor is None:
+                self.details_executor = ThreadPoolExecutor(max_workers=max(1, self.config.get('max_threads', 5)))
+            future = self.details_executor.submit(self.get_wallpaper_details, f"{self.base_url}/w/{wallpaper_id}")
+            self.details_memo[wallpaper_id] = future
+        # 已完成的 Future 会立即调用回调，必须在释放锁之后注册
+        future.add_done_callback(lambda done: self.forget_failed_details(wallpaper_id, done))
+        return future
+
+    def forget_failed_details(self, wallpaper_id, future):
+        if future.cancelled() or future.exception() is not None or future.result() is None:
+            with self._details_lock:
+                if self.details_memo.get(wallpaper_id) is future:
+                    del self.details_memo[wallpaper_id]
+
+    def release_details(self):
+        """一次运行结束后丢弃已完成的详情页结果，同步和工作进程模式长期运行时不会无限增长
+
+        启用响应缓存时再次需要的详情页从缓存中读取；仍在进行的请求保留，其他线程可以继续共用。
+        """
+        with self._details_lock:
+            self.details_memo = {wallpaper_id: future for wallpaper_id, future in self.details_memo.items() if not future.done()}
+
+    def missing_details(self, wallpaper, fields):
+        """返回列表页信息中缺少的详情字段"""
+        missing = []
+        for field in fields:
+            if field == 'download_url':
+                # API 给出的原图地址和已确认的扩展名都是准确的
+                known = wallpaper.download_url != wallpaper.default_download_url() or wallpaper['id'] in self.extension_cache
+            elif field == 'resolution':
+                known = wallpaper['resolution'] != 'Unknown'
+            else:
+                known = wallpaper[field] is not None
+            if not known:
+                missing.append(field)
+        return missing
+
+    def enrich_wallpapers(self, wallpapers):
+        """并发请求详情页，补全 detail_fields 中配置的字段
+
+        列表页信息已足够的壁纸不请求详情页；请求在详情线程池中执行，受全局速率限制器控制。
+        """
+        fields = self.config['detail_fields']
+        if not fields or not wallpapers:
+            return wallpapers
+        pending = [(wallpaper, self.submit_details(wallpaper['id'])) for wallpaper in wallpapers if self.missing_details(wallpaper, fields)]
+        self.count_stat('details_skipped', len(wallpapers) - len(pending))
+        for wallpaper, future in pending:
+            details = future.result()
+            if details:
+                self.apply_details(wallpaper, details)
+                self.count_stat('details_fetched')
+            else:
+                self.count_stat('details_failed')
+        return wallpapers
+
+    def apply_details(self, wallpaper, details):
+        """把详情页信息写入壁纸记录"""
+        self.extension_cache[wallpaper['id']] = details['extension']
+        wallpaper['extension'] = details['extension']
+        wallpaper['download_url'] = details['download_url']
+        if details.get('resolution', 'Unknown') != 'Unknown':
+            wallpaper['resolution'] = details['resolution']
+        for field in ('file_size', 'tags', 'colors', 'purity'):
+            if details.get(field) is not None:
+                wallpaper[field] = details[field]
+
+    def print_details_summary(self):
+        """输出本次运行的详情页补全情况"""
+        fetched = self.run_stats.get('details_fetched', 0)
+        skipped = self.run_stats.get('details_skipped', 0)
+        failed = self.run_stats.get('details_failed', 0)
+        if fetched or skipped or failed:
+            self.console.print(f"[cyan]详情页: 补全 {fetched}, 列表页信息已足够 {skipped}, 失败 {failed}[/cyan]")
+
+    def parse_wallpaper_details(self, html_text, wallpaper_url):
+        """解析壁纸详情页，找不到原图时返回 None"""
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html_text, 'html.parser')
+
+        # 根据页面结构，查找壁纸图片的真实URL
+        # 壁纸图片通常在<main>标签内的<img>标签中
+        img_element = soup.select_one('main img[src*="wallhaven.cc"]')
+        if not img_element:
+            # 尝试其他可能的选择器
+            img_element = soup.select_one('img#wallpaper')
+
+        if img_element:
+            # 获取图片的真实URL
+            img_src = img_element.get('src') or img_element.get('data-src')
+            if img_src:
+                # 确保URL是完整的
+                if img_src.startswith('//'):
+                    img_src = 'https:' + img_src
+                elif img_src.startswith('/'):
+                    img_src = urljoin(self.base_url, img_src)
+
+                parsed = urlparse(img_src)
+                filename = os.path.basename(parsed.path)
+                wallpaper_id = filename.split('.')[0] if '.' in filename else self.extract_wallpaper_id_from_url(
+                    wallpaper_url)
+
+                extension = self.parse_wallpaper_extension_from_filename(filename)
+
+                # 查找分辨率信息
+                resolution_elem = soup.select_one('h3')  # 分辨率通常在h3标签中
+                res_match = RESOLUTION_PATTERN.search(resolution_elem.get_text()) if resolution_elem else None
+                resolution = f"{res_match.group(1)} x {res_match.group(2)}" if res_match else 'Unknown'
+
+                # 侧边栏中的 <dt>Size</dt><dd>2.3 MiB</dd> 等信息
+                info = {}
+                for dt in soup.select('#showcase-sidebar dt'):
+                    dd = dt.find_next_sibling('dd')
+                    if dd:
+                        info[dt.get_text(strip=True).lower()] = dd.get_text(strip=True)
+                purity = info.get('purity', '').lower()
+                if purity not in PURITIES:
+                    purity_elem = soup.select_one('#showcase-sidebar .purity')
+                    purity = next((cls for cls in (purity_elem.get('class', []) if purity_elem else []) if cls in PURITIES), None)
+
+                colors = []
+                for color_elem in soup.select('.color-palette .color'):
+                    color_match = COLOR_PATTERN.search(color_elem.get('style', '') + ' ' + color_elem.get_text())
+                    if color_match:
+                        colors.append(color_match.group(0).lower())
+
+                return {
+                    'id': wallpaper_id,
+                    'download_url': img_src,
+                    'extension': extension,
+                    'resolution': resolution,
+                    'file_size': parse_size(info.get('size')),
+                    'tags': [tag.get_text(strip=True) for tag in soup.select('#tags .tagname')],
+                    'colors': colors,
+                    'purity': purity
+                }
+
+        return None
+
     def parse_wallpaper_extension_from_filename(self, filename):
         """从文件名解析扩展名"""
         if '.' in filename:
@@ -389,80 +2182,606 @@ class WallhavenSpider:
             return parts[-1]
         return 'unknown'
 
+    def build_filepath(self, wallpaper_id, extension, category, download_dir):
+        """构建壁纸保存路径，并创建分类子目录"""
+        category_dir = os.path.join(download_dir, category)
+        os.makedirs(category_dir, exist_ok=True)
+        return os.path.join(category_dir, f"wallhaven-{wallpaper_id}.{extension}")
+
+    def expected_download_size(self, status_code, headers, resume_from):
+        """根据响应头计算下载完成后文件应有的总字节数，无法确定时返回 None"""
+        if status_code == 206:
+            # Content-Range: bytes 1000-1999/2000
+            content_range = headers.get('Content-Range', '')
+            total = content_range.rsplit('/', 1)[-1]
+            if total.isdigit():
+                return int(total)
+            content_length = headers.get('Content-Length')
+            return resume_from + int(content_length) if content_length and content_length.isdigit() else None
+
+        # 压缩传输时 Content-Length 与解压后的字节数不一致，无法校验
+        if headers.get('Content-Encoding'):
+            return None
+        content_length = headers.get('Content-Length')
+        return int(content_length) if content_length and content_length.isdigit() else None
+
+    def download_buffer(self):
+        """每个下载线程复用的读取缓冲区"""
+        buffer = getattr(self._download_buffers, 'buffer', None)
+        if buffer is None:
+            buffer = self._download_buffers.buffer = bytearray(max(64, self.config['write_buffer_kb']) * 1024)
+        return buffer
+
+    def read_size(self):
+        """每次读取的字节数；限制带宽时读取粒度不超过每秒预算的十分之一，避免一次读取后长时间停顿"""
+        size = max(64, self.config['write_buffer_kb']) * 1024
+        if self.bandwidth is not None:
+            size = min(size, max(64 * 1024, int(self.bandwidth.rate) // 10))
+        return size
+
+    def read_body_into(self, response, buffer):
+        """把响应体逐块读入可复用的缓冲区，返回缓冲区的 memoryview 切片，下一次读取前需用完"""
+        raw = response.raw
+        # 没有压缩编码时直接从 http.client 读入缓冲区，跳过 urllib3 每次读取时分配的临时 bytes
+        fp = getattr(raw, '_fp', None)
+        direct = fp is not None and hasattr(fp, 'readinto') and not response.headers.get('Content-Encoding')
+        readinto = fp.readinto if direct else raw.readinto
+        view = memoryview(buffer)[:self.read_size()]
+        while True:
+            try:
+                size = readinto(view)
+            except (http.client.HTTPException, OSError, urllib3.exceptions.HTTPError) as e:
+                # 与 iter_content 一样按连接中断处理，保留临时文件续传
+                raise IncompleteDownloadError(f"连接中断: {e}") from e
+            if not size:
+                break
+            yield view[:size]
+        if direct:
+            # 绕过了 urllib3 的读取路径，读完后手动把连接放回连接池
+            raw.release_conn()
+
+    def open_part_file(self, part_path, mode, expected_size):
+        """按配置的预分配和刷新策略打开 .part 临时文件"""
+        return PartFileWriter(part_path, mode == 'ab', expected_size, preallocate=self.config['preallocate'],
+                              fsync_policy=self.config['fsync_policy'], fsync_batch_bytes=self.config['fsync_batch_mb'] * 1024 * 1024)
+
+    def record_write_metrics(self, writer, write_seconds):
+        self.metrics.observe('disk_write_seconds', write_seconds)
+        if writer is not None:
+            self.metrics.inc('downloaded_bytes', writer.written)
+            self.metrics.inc('disk_writes', writer.writes)
+            self.metrics.inc('disk_fsyncs', writer.fsyncs)
+
+    def download_to_part_file(self, download_url, part_path, verifier=None):
+        """下载到 .part 临时文件，已有部分内容时使用 Range 请求续传，verifier 在写入时同步计算哈希"""
+        resume_from = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if verifier is not None:
+            verifier.resume(part_path, resume_from)
+        headers = {'Range': f'bytes={resume_from}-'} if resume_from else None
+
+        # 下载文件，使用配置的超时值
+        with self.request('GET', download_url, stream=True, headers=headers) as response:
+            if response.status_code == 416:
+                # 临时文件与服务器上的文件不一致，丢弃后重新下载
+                os.remove(part_path)
+                raise IncompleteDownloadError("临时文件无效，重新下载")
+            response.raise_for_status()
+
+            # 服务器不支持 Range 时返回完整文件，需要从头写入
+            mode = 'ab' if response.status_code == 206 else 'wb'
+            if mode == 'wb' and verifier is not None:
+                verifier.reset()
+            expected_size = self.expected_download_size(response.status_code, response.headers, resume_from)
+
+            write_seconds = 0.0
+            writer = None
+            try:
+                with self.open_part_file(part_path, mode, expected_size) as writer:
+                    for chunk in self.read_body_into(response, self.download_buffer()):
+                        if self.bandwidth is not None:
+                            self.bandwidth.acquire(len(chunk))
+                        started = time.perf_counter()
+                        writer.write(chunk)
+                        write_seconds += time.perf_counter() - started
+                        if verifier is not None:
+                            verifier.update(chunk)
+                        # 检查是否被中断
+                        if self.interrupted:
+                            raise KeyboardInterrupt("下载被用户中断")
+            finally:
+                self.record_write_metrics(writer, write_seconds)
+
+        actual_size = os.path.getsize(part_path)
+        if expected_size is not None and actual_size != expected_size:
+            raise IncompleteDownloadError(f"下载不完整: {actual_size}/{expected_size} 字节")
+
+    def download_file(self, download_url, filepath):
+        """下载文件到 .part 临时文件，中断时断点续传，校验完整后原子重命名，返回 (最终路径, SHA-256)"""
+        part_path = filepath + '.part'
+        verifier = StreamVerifier()
+        max_retries = self.config['max_retries']
+        for attempt in range(max_retries + 1):
+            try:
+                self.download_to_part_file(download_url, part_path, verifier)
+                self.verify_download(part_path, verifier)
+                break
+            except requests.exceptions.HTTPError:
+                raise
+            except (requests.exceptions.RequestException, IncompleteDownloadError) as e:
+                # 连接中断时保留临时文件，退避后从断点续传
+                if attempt >= max_retries:
+                    raise
+                self.count_stat('retries')
+                self.console.print(f"[yellow]下载中断，准备续传 ({attempt + 1}/{max_retries}) {download_url}: {str(e)}[/yellow]")
+                time.sleep(self.backoff_delay(attempt))
+
+        return self.finish_download(part_path, filepath, verifier)
+
+    def verify_download(self, part_path, verifier):
+        """检查下载内容的文件头，不是有效图片时删除临时文件以便重新下载"""
+        if not self.config['verify_images'] or detect_image_type(verifier.header) is not None:
+            return
+        os.remove(part_path)
+        verifier.reset()
+        self.count_stat('corrupt_files')
+        raise CorruptDownloadError("下载的内容不是有效的图片")
+
+    def finish_download(self, part_path, filepath, verifier):
+        """把校验通过的临时文件重命名为最终文件并放入内容存储，返回 (最终路径, SHA-256)"""
+        if self.config['verify_images']:
+            # 文件头与扩展名不符时按实际格式保存
+            actual = detect_image_type(verifier.header)
+            root, extension = os.path.splitext(filepath)
+            if actual != extension[1:].lower().replace('jpeg', 'jpg'):
+                filepath = f"{root}.{actual}"
+                self.count_stat('extension_fixed')
+        os.replace(part_path, filepath)
+        if self.config['fsync_policy'] != 'none':
+            self.fsync_directory(os.path.dirname(filepath))
+        digest = verifier.hexdigest()
+        self.link_to_content_store(filepath, digest, verifier.size)
+        return filepath, digest
+
+    def fsync_directory(self, directory):
+        """刷新目录项，使重命名后的文件在断电后仍然存在"""
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        try:
+            fd = os.open(directory or '.', os.O_RDONLY | os.O_DIRECTORY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def link_to_content_store(self, filepath, digest, size):
+        """按 SHA-256 把文件硬链接到内容存储，内容相同的文件共享同一份数据"""
+        if not self.config['content_store']:
+            return
+        store_path = os.path.join(self.config['download_dir'], '.store', digest[:2], digest + os.path.splitext(filepath)[1])
+        try:
+            os.makedirs(os.path.dirname(store_path), exist_ok=True)
+            try:
+                os.link(filepath, store_path)
+                return
+            except FileExistsError:
+                pass
+            if os.path.samefile(store_path, filepath):
+                return
+            # 相同内容已以其他 ID 下载过，用指向已有数据的硬链接替换刚下载的副本
+            link_path = filepath + '.link'
+            os.link(store_path, link_path)
+            os.replace(link_path, filepath)
+            self.count_stat('dedup_files')
+            self.count_stat('dedup_bytes', size)
+        except OSError:
+            # 文件系统不支持硬链接时不去重
+            pass
+
     def download_wallpaper(self, download_url, wallpaper_id, extension, category='misc', download_dir='downloads'):
-        """下载单个壁纸"""
+        """下载单个壁纸，扩展名猜错导致404时自动改用正确的扩展名"""
         try:
-            # 创建分类子目录
-            category_dir = os.path.join(download_dir, category)
-            os.makedirs(category_dir, exist_ok=True)
+            # 已确认过扩展名的壁纸直接使用正确的下载链接
+            confirmed = self.extension_cache.get(wallpaper_id)
+            if confirmed and confirmed != extension:
+                extension = confirmed
+                download_url = self.build_download_url(wallpaper_id, extension)
 
-            # 构建保存路径
-            filepath = os.path.join(category_dir, f"wallhaven-{wallpaper_id}.{extension}")
+            filepath = self.build_filepath(wallpaper_id, extension, category, download_dir)
 
-            # 检查文件是否已存在
+            # 检查文件是否已存在，只有完整下载的文件才会使用最终文件名
             if os.path.exists(filepath):
                 self.console.print(f"[yellow]文件已存在，跳过: {filepath}[/yellow]")
                 return True
 
-            # 下载文件，使用配置的超时值
-            response = self.session.get(download_url, stream=True, timeout=self.config['timeout'])
-            response.raise_for_status()
-
-            with open(filepath, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-                    # 检查是否被中断
-                    if hasattr(self, 'interrupted') and self.interrupted:
-                        raise KeyboardInterrupt("下载被用户中断")
-
+            try:
+                with self.metrics.timer('download_seconds'):
+                    filepath, digest = self.download_file(download_url, filepath)
+            except requests.exceptions.HTTPError as e:
+                if e.response is None or e.response.status_code != 404:
+                    raise
+                self.count_stat('wasted_requests')
+                resolved = self.resolve_extension(wallpaper_id, extension)
+                if resolved is None:
+                    raise
+                extension, download_url = resolved
+                filepath = self.build_filepath(wallpaper_id, extension, category, download_dir)
+                digest = None
+                if not os.path.exists(filepath):
+                    with self.metrics.timer('download_seconds'):
+                        filepath, digest = self.download_file(download_url, filepath)
+
+            # 文件头校验可能按实际格式修正了扩展名
+            extension = os.path.splitext(filepath)[1][1:]
+            # 哈希只在写入索引时使用，不使用索引时不保存，避免长时间运行时不断累积
+            if digest and self.config['use_index']:
+                self.file_hashes[wallpaper_id] = digest
+            self.extension_cache[wallpaper_id] = extension
             self.console.print(f"[green]下载完成: {filepath}[/green]")
             return True
         except Exception as e:
             self.console.print(f"[red]下载失败 {download_url}: {str(e)}[/red]")
             return False
 
-    def crawl_by_category(self, category, tag=None):
-        """按类别爬取壁纸"""
-        self.console.print(f"[bold blue]开始爬取 {category} 类别壁纸...[/bold blue]")
+    def alternate_extensions(self, extension):
+        """返回除已尝试扩展名外的候选扩展名，Wallhaven 原图只有 jpg 和 png 两种"""
+        return [ext for ext in ('jpg', 'png') if ext != extension]
 
-        # 获取筛选参数
-        time_range = self.get_time_range_filter()
-        resolution = self.get_resolution_filter()
+    def resolve_extension(self, wallpaper_id, failed_extension):
+        """用 HEAD 请求探测正确的扩展名，最后才访问详情页"""
+        for extension in self.alternate_extensions(failed_extension):
+            download_url = self.build_download_url(wallpaper_id, extension)
+            try:
+                response = self.request('HEAD', download_url, allow_redirects=True)
+            except requests.exceptions.RequestException:
+                continue
+            if response.status_code == 200:
+                self.extension_cache[wallpaper_id] = extension
+                self.count_stat('extension_fixed')
+                return extension, download_url
+            self.count_stat('wasted_requests')
+
+        # 详情页请求较慢，只作为最后手段
+        details = self.submit_details(wallpaper_id).result()
+        if details:
+            self.extension_cache[wallpaper_id] = details['extension']
+            self.count_stat('extension_fixed')
+            return details['extension'], details['download_url']
+        return None
+
+    def reset_run_stats(self):
+        """在新一批下载开始前清空统计数据"""
+        with self._stats_lock:
+            self.run_stats.clear()
+
+    def count_stat(self, key, amount=1):
+        """线程安全地累加本次运行的统计数据"""
+        with self._stats_lock:
+            self.run_stats[key] = self.run_stats.get(key, 0) + amount
+        self.metrics.inc(key, amount)
+
+    def write_metrics(self):
+        """把运行指标写入配置的指标文件"""
+        if self.config['metrics_file']:
+            self.metrics.write(self.config['metrics_file'])
+
+    def print_cache_summary(self):
+        """输出本次运行的缓存命中率和节省的字节数"""
+        hits = self.run_stats.get('cache_hits', 0)
+        lookups = hits + self.run_stats.get('cache_misses', 0)
+        if lookups:
+            saved = self.format_size(self.run_stats.get('cache_bytes_saved', 0))
+            self.console.print(f"[cyan]缓存命中: {hits}/{lookups} ({hits / lookups:.0%}), 节省下载: {saved}[/cyan]")
+
+    def print_download_summary(self, success_count, failed_count, total, skipped_count=None):
+        """输出下载结果汇总，并返回可供批处理模式使用的统计数据"""
+        skipped = f", 已存在: {skipped_count}" if skipped_count is not None else ""
+        self.console.print(f"[bold green]下载完成! 成功: {success_count}, 失败: {failed_count}{skipped}, 总计: {total}[/bold green]")
+        extension_fixed = self.run_stats.get('extension_fixed', 0)
+        wasted_requests = self.run_stats.get('wasted_requests', 0)
+        if extension_fixed or wasted_requests:
+            self.console.print(f"[yellow]扩展名纠正: {extension_fixed}, 无效请求: {wasted_requests}[/yellow]")
+        retries = self.run_stats.get('retries', 0)
+        throttled = self.run_stats.get('throttled', 0)
+        if retries or throttled:
+            self.console.print(f"[yellow]重试: {retries}, 被限流 (429): {throttled}[/yellow]")
+        self.print_details_summary()
+        self.print_cache_summary()
+
+        return {
+            'total': total,
+            'success': success_count,
+            'failed': failed_count,
+            'skipped': skipped_count or 0,
+            **self.run_stats
+        }
+
+    def filter_known_wallpapers(self, wallpapers, category):
+        """用索引批量过滤已下载的壁纸，其他分类目录中已有的文件直接硬链接过来"""
+        if self.index is None or not wallpapers:
+            return wallpapers
+
+        known = self.index.lookup(wp['id'] for wp in wallpapers)
+        if not known:
+            return wallpapers
+
+        pending = []
+        linked_count = 0
+        category_dir = os.path.join(self.config['download_dir'], category)
+        for wallpaper in wallpapers:
+            source = known.get(wallpaper['id'])
+            if source is None:
+                pending.append(wallpaper)
+                continue
+
+            target = os.path.join(category_dir, os.path.basename(source))
+            if os.path.abspath(source) == os.path.abspath(target):
+                continue
+
+            # 同一壁纸已在其他分类中下载过，硬链接到当前分类目录而不是重新下载
+            try:
+                os.makedirs(category_dir, exist_ok=True)
+                os.link(source, target)
+                linked_count += 1
+            except FileExistsError:
+                pass
+            except FileNotFoundError:
+                # 索引中的文件已被删除，重新下载
+                self.index.forget(wallpaper['id'])
+                pending.append(wallpaper)
+            except OSError:
+                # 跨文件系统等无法硬链接的情况，退回到复制文件
+                try:
+                    shutil.copy2(source, target)
+                    linked_count += 1
+                except OSError as e:
+                    # 源文件无法读取时删除索引记录和复制了一半的文件，重新下载这个壁纸，不影响其他壁纸
+                    self.console.print(f"[yellow]无法复制已下载的文件 {source}，将重新下载: {e}[/yellow]")
+                    self.index.forget(wallpaper['id'])
+                    if os.path.exists(target):
+                        os.remove(target)
+                    pending.append(wallpaper)
+
+        self.index.touch(known)
+        skipped_count = len(wallpapers) - len(pending)
+        if skipped_count:
+            self.console.print(f"[yellow]索引中已存在 {skipped_count} 个壁纸，跳过下载 (其中硬链接 {linked_count} 个)[/yellow]")
+        return pending
+
+    def index_downloaded(self, wallpaper, category):
+        """把下载完成的壁纸记录到索引中"""
+        sha256 = self.file_hashes.pop(wallpaper['id'], None)
+        if self.index is None:
+            return
+        # 下载时可能纠正了列表页猜测的扩展名
+        wallpaper['extension'] = self.extension_cache.get(wallpaper['id'], wallpaper['extension'])
+        wallpaper['download_url'] = None
+        filepath = self.build_filepath(wallpaper['id'], wallpaper['extension'], category, self.config['download_dir'])
+        try:
+            size = os.path.getsize(filepath)
+        except OSError:
+            return
+        self.index.record_download(wallpaper['id'], os.path.abspath(filepath), size, wallpaper['extension'], wallpaper.get('resolution', 'Unknown'),
+                                   sha256=sha256)
+
+    def fetch_pages(self, category, page_numbers, params=None, on_page_done=None):
+        """并发获取多个列表页，按页码顺序返回每页的壁纸列表
+
+        on_page_done(page_num, wallpapers) 在每页完成时调用，获取失败的页 wallpapers 为 None。
+        """
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        if not page_numbers:
+            return []
 
+        def page_done(page_num, wallpapers):
+            if wallpapers is not None:
+                self.export_page(category, page_num, wallpapers)
+            if on_page_done:
+                on_page_done(page_num, wallpapers)
+
+        if self.use_async_backend():
+            return self.fetch_pages_async(category, page_numbers, params, on_page_done=page_done)
+
+        max_workers = max(1, min(self.config['max_page_workers'], len(page_numbers)))
+        results = {}
+
+        def fetch(page_num):
+            try:
+                return self.enrich_wallpapers(self.get_wallpapers_from_page(category, page_num, params, raise_errors=True))
+            except Exception:
+                return None
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            future_to_page = {executor.submit(fetch, page_num): page_num for page_num in page_numbers}
+            for future in as_completed(future_to_page):
+                page_num = future_to_page[future]
+                results[page_num] = future.result()
+                page_done(page_num, results[page_num])
+                # 检查是否被中断
+                if self.interrupted:
+                    raise KeyboardInterrupt("爬取被用户中断")
+        except KeyboardInterrupt:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown(wait=True)
+
+        return [results[page_num] or [] for page_num in page_numbers]
+
+    def build_search_params(self, category, tag=None, time_range='all', resolution=None):
+        """根据筛选条件构建列表页查询参数"""
         # 准备参数
         params = {'tag': tag} if tag else {}
-        
+
         # 添加时间范围和分辨率筛选参数
         if time_range != 'all':
             params['topRange'] = time_range
         if resolution:
             params['resolutions'] = resolution
             params['atleast'] = resolution  # 至少指定分辨率
+        # API 随机排序需要固定种子，多页之间才不会出现重复壁纸
+        if category == 'random' and self.config['listing_backend'] == 'api':
+            params['seed'] = self.config['api_seed'] or self.new_random_seed()
+        return params
+
+    def job_key(self, category, params):
+        """生成任务日志和任务队列使用的任务标识；自动生成的随机种子不计入标识，中断的随机排序任务也能续传"""
+        if 'seed' in params and not self.config['api_seed']:
+            params = {key: value for key, value in params.items() if key != 'seed'}
+        return CrawlJournal.job_key(category, params, self.config['listing_backend'])
+
+    def run_job(self, category, page_numbers, tag=None, time_range='all', resolution=None, download=True):
+        """非交互地执行一个爬取任务，返回任务统计数据
+
+        启用任务日志时，中断后重新运行相同的任务会跳过已完成的页，只重试失败或未完成的下载。
+        """
+        self.console.print(f"[bold blue]开始爬取 {category} 类别壁纸 (第 {page_numbers[0]}-{page_numbers[-1]} 页)...[/bold blue]")
+        self.reset_run_stats()
+        params = self.build_search_params(category, tag, time_range, resolution)
+
+        job = None
+        if self.journal is not None:
+            job = self.job_key(category, params)
+            if 'seed' in params:
+                # 续传时沿用中断前的随机种子，剩余页的排序才与已完成的页一致
+                params['seed'] = self.journal.job_seed(job, params['seed'])
+            completed_pages = self.journal.completed_pages(job)
+            if completed_pages:
+                page_numbers = [page_num for page_num in page_numbers if page_num not in completed_pages]
+                self.console.print(f"[yellow]从任务日志恢复: 跳过已完成的 {len(completed_pages)} 页[/yellow]")
+
+        if download and self.config['stream_downloads']:
+            stats = self.crawl_streaming(category, page_numbers, params, journal_job=job)
+        else:
+            stats = self.fetch_and_download(category, page_numbers, params, download, job)
+
+        # 全部完成后清除任务日志，有失败时保留日志供下次续传
+        if job is not None and stats['failed'] == 0 and not stats.get('failed_pages'):
+            self.journal.finish(job)
+        self.release_details()
+        return stats
+
+    def sync_query(self, category, tag=None, resolution=None, download=True):
+        """同步一次 latest 或标签搜索：从第一页开始翻页，遇到上次见过的壁纸就停止，只下载新壁纸
+
+        稳定运行时每次同步通常只需要请求一两页。每个查询的高水位标记保存在索引数据库中，
+        下载失败的壁纸会在下一次同步时重试。
+        """
+        if category not in WATCH_CATEGORIES:
+            raise ValueError(f"同步模式只支持 {', '.join(WATCH_CATEGORIES)} 类别，{category} 的结果不按上传时间排序")
+        self.reset_run_stats()
+        params = self.build_search_params(category, tag, 'all', resolution)
+        if category == 'tag':
+            # 标签搜索默认按相关度排序，按上传时间排序后新壁纸才总在最前面
+            params['sorting'] = 'date_added'
+            params['order'] = 'desc'
+
+        query = SyncState.query_key(category, params)
+        state = self.sync_state.load(query)
+        known = set(state['marks']) if state else set()
+        max_pages = self.config['watch_max_pages'] if state else self.config['watch_initial_pages']
+
+        new_wallpapers = []
+        seen = set()
+        reached_mark = False
+        pages = 0
+        for page_num in range(1, max(1, max_pages) + 1):
+            wallpapers = self.get_wallpapers_from_page(category, page_num, params, raise_errors=True, revalidate=True)
+            pages += 1
+            fresh = []
+            for wallpaper in wallpapers:
+                if wallpaper['id'] in known:
+                    reached_mark = True
+                    break
+                # 翻页期间有新上传时，后一页开头会重复出现前一页末尾的壁纸
+                if wallpaper['id'] not in seen:
+                    seen.add(wallpaper['id'])
+                    fresh.append(wallpaper)
+            self.enrich_wallpapers(fresh)
+            self.export_page(category, page_num, fresh)
+            new_wallpapers.extend(fresh)
+            if reached_mark or not wallpapers:
+                break
+        if state and not reached_mark:
+            self.console.print(f"[yellow]{max_pages} 页内没有找到上次同步的位置，可能有壁纸被遗漏，可增大 watch_max_pages 或缩短同步间隔[/yellow]")
+
+        # 上次下载失败的壁纸一起重试
+        retry = [wallpaper for wallpaper in self.as_wallpapers(state['pending'] if state else []) if wallpaper['id'] not in seen]
+        failed = []
+        stats = {'total': 0, 'success': 0, 'failed': 0, 'skipped': 0}
+        if download and (new_wallpapers or retry):
+            stats = self.download_wallpapers(new_wallpapers + retry, category=category,
+                                             on_result=lambda wallpaper, success: None if success else failed.append(wallpaper))
+        marks = [wallpaper['id'] for wallpaper in new_wallpapers] + (state['marks'] if state else [])
+        self.sync_state.save(query, marks, [wallpaper.to_dict() for wallpaper in failed])
+        self.release_details()
+        self.console.print(f"[bold green]同步 {category}{f' ({tag})' if tag else ''}: 请求 {pages} 页，新壁纸 {len(new_wallpapers)} 个，重试 {len(retry)} 个[/bold green]")
+        return {**stats, **self.run_stats, 'pages': pages, 'new': len(new_wallpapers), 'retried': len(retry), 'reached_mark': reached_mark}
+
+    def fetch_and_download(self, category, page_numbers, params, download=True, job=None):
+        """获取全部列表页后批量下载，job 不为空时把进度写入任务日志"""
+        failed_pages = []
+
+        def on_page_done(page_num, wallpapers):
+            if wallpapers is None:
+                failed_pages.append(page_num)
+            elif job is not None:
+                self.journal.record_page(job, page_num, wallpapers)
+
+        pages = self.fetch_pages(category, page_numbers, params, on_page_done=on_page_done)
+        if job is not None:
+            # 包括之前运行中已登记但尚未下载成功的壁纸
+            wallpapers = self.as_wallpapers(self.journal.pending_wallpapers(job))
+        else:
+            wallpapers = [wp for page in pages for wp in page]
+
+        if not download:
+            self.console.print(f"[bold green]共找到 {len(wallpapers)} 个壁纸[/bold green]")
+            self.print_details_summary()
+            self.print_cache_summary()
+            stats = {'total': len(wallpapers), 'success': 0, 'failed': 0, 'skipped': 0, **self.run_stats}
+        else:
+            on_result = (lambda wallpaper, success: self.journal.record_result(job, wallpaper['id'], success)) if job is not None else None
+            stats = self.download_wallpapers(wallpapers, category=category, on_result=on_result)
+        stats['failed_pages'] = len(failed_pages)
+        return stats
+
+    def crawl_by_category(self, category, tag=None):
+        """按类别爬取壁纸"""
+        from rich.prompt import Prompt
+        self.console.print(f"[bold blue]开始爬取 {category} 类别壁纸...[/bold blue]")
+        self.reset_run_stats()
+
+        # 获取筛选参数
+        time_range = self.get_time_range_filter()
+        resolution = self.get_resolution_filter()
+
+        params = self.build_search_params(category, tag, time_range, resolution)
 
         # 获取页面范围
         page_numbers = self.get_page_range()
 
+        # 流式模式下不再汇总展示和询问，边解析列表页边下载
+        if self.config['stream_downloads']:
+            self.crawl_streaming(category, page_numbers, params)
+            return
+
         all_wallpapers = []
 
-        with Progress(
-                SpinnerColumn(),
-                TextColumn("[progress.description]{task.description}"),
-                BarColumn(),
-                TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
-        ) as progress:
+        with self.create_progress() as progress:
 
-            overall_task = progress.add_task(description="[cyan]总体进度...", total=len(page_numbers))
+            overall_task = progress.add_task(description="[cyan]正在爬取列表页...", total=len(page_numbers))
 
-            for i, page_num in enumerate(page_numbers):
-                progress.update(overall_task, description=f"[cyan]正在爬取第 {page_num} 页...")
+            def on_page_done(page_num, wallpapers):
+                progress.update(overall_task, advance=1, description=f"[cyan]已完成第 {page_num} 页...")
 
-                wallpapers = self.get_wallpapers_from_page(category, page_num, params)
+            # 多页并发获取，请求间隔由全局速率限制器控制，结果按页码顺序返回
+            for wallpapers in self.fetch_pages(category, page_numbers, params, on_page_done=on_page_done):
                 all_wallpapers.extend(wallpapers)
 
-                progress.update(overall_task, advance=1)
-                # 仅在页面请求之间延时，解析HTML不需要延时
-                time.sleep(self.config['delay_between_requests'])  # 使用配置中的延迟时间
-
         # 显示结果
         self.display_results(all_wallpapers, category)
 
@@ -472,9 +2791,138 @@ class WallhavenSpider:
             if should_download == 'y':
                 self.download_wallpapers(all_wallpapers, category=category)
 
-    def display_results(self, wallpapers, category):
-        """使用Rich库显示结果表格"""
-        table = Table(title=f"{category.upper()} 类别壁纸列表")
+    def crawl_streaming(self, category, page_numbers, params=None, journal_job=None):
+        """流式爬取：每解析完一页就把壁纸放入有界队列，下载线程同时消费"""
+        # 有界队列让列表页解析受下载速度反压，内存占用与页数无关
+        work_queue = queue.Queue(maxsize=self.config['stream_queue_size'])
+        stop_event = threading.Event()
+        pages = iter(page_numbers)
+        pages_lock = threading.Lock()
+
+        max_page_workers = max(1, min(self.config['max_page_workers'], len(page_numbers)))
+        max_threads = max(1, self.config.get('max_threads', 5))
+
+        # 统计成功和失败的数量
+        stats = {'found': 0, 'skipped': 0, 'success': 0, 'failed': 0, 'failed_pages': 0}
+        stats_lock = threading.Lock()
+
+        def put_wallpaper(item):
+            # 队列满时阻塞等待，同时响应中断
+            while not stop_event.is_set():
+                try:
+                    work_queue.put(item, timeout=0.2)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def enqueue(wallpapers):
+            found_count = len(wallpapers)
+            # 每页一次批量查询索引，已下载的壁纸不再入队
+            wallpapers = self.filter_known_wallpapers(wallpapers, category)
+            with stats_lock:
+                stats['found'] += found_count
+                stats['skipped'] += found_count - len(wallpapers)
+            for wallpaper in wallpapers:
+                if not put_wallpaper(wallpaper):
+                    return False
+            return True
+
+        def produce():
+            while not stop_event.is_set():
+                with pages_lock:
+                    page_num = next(pages, None)
+                if page_num is None:
+                    return
+                try:
+                    wallpapers = self.enrich_wallpapers(self.get_wallpapers_from_page(category, page_num, params, raise_errors=True))
+                except Exception:
+                    with stats_lock:
+                        stats['failed_pages'] += 1
+                    continue
+                self.export_page(category, page_num, wallpapers)
+                if journal_job is not None:
+                    self.journal.record_page(journal_job, page_num, wallpapers)
+                if not enqueue(wallpapers):
+                    return
+
+        # 上次运行中已登记但尚未下载成功的壁纸，需要在本次新登记之前读取
+        resumed = self.as_wallpapers(self.journal.pending_wallpapers(journal_job)) if journal_job is not None else []
+
+        def resume_pending():
+            enqueue(resumed)
+
+        def consume():
+            while True:
+                wallpaper = work_queue.get()
+                if wallpaper is None or stop_event.is_set():
+                    return
+                result = self.download_wallpaper(wallpaper['download_url'], wallpaper['id'], wallpaper['extension'], category=category, download_dir=self.config['download_dir'])
+                if result:
+                    self.index_downloaded(wallpaper, category)
+                if journal_job is not None:
+                    self.journal.record_result(journal_job, wallpaper['id'], result)
+                with stats_lock:
+                    if result:
+                        stats['success'] += 1
+                    else:
+                        stats['failed'] += 1
+
+        producers = [threading.Thread(target=produce, daemon=True) for _ in range(max_page_workers)]
+        if resumed:
+            producers.append(threading.Thread(target=resume_pending, daemon=True))
+        consumers = [threading.Thread(target=consume, daemon=True) for _ in range(max_threads)]
+        for thread in producers + consumers:
+            thread.start()
+
+        with self.create_progress(counter=None) as progress:
+
+            stream_task = progress.add_task(description="[cyan]开始流式下载...", total=None)
+
+            try:
+                # 所有列表页解析完成后通知下载线程退出
+                while any(thread.is_alive() for thread in producers):
+                    for thread in producers:
+                        thread.join(timeout=0.2)
+                    self.metrics.set_gauge('stream_queue_depth', work_queue.qsize())
+                    with stats_lock:
+                        done = stats['success'] + stats['failed'] + stats['skipped']
+                        progress.update(stream_task, description=f"[cyan]已找到 {stats['found']} 个壁纸，已处理 {done} 个...")
+                for _ in consumers:
+                    put_wallpaper(None)
+                while any(thread.is_alive() for thread in consumers):
+                    for thread in consumers:
+                        thread.join(timeout=0.2)
+                    self.metrics.set_gauge('stream_queue_depth', work_queue.qsize())
+                    with stats_lock:
+                        done = stats['success'] + stats['failed'] + stats['skipped']
+                        progress.update(stream_task, description=f"[cyan]列表页已完成，已处理 {done}/{stats['found']} 个...")
+                    # 检查是否被中断
+                    if self.interrupted:
+                        raise KeyboardInterrupt("下载被用户中断")
+            except KeyboardInterrupt:
+                stop_event.set()
+                raise
+
+        summary = self.print_download_summary(stats['success'], stats['failed'], stats['found'], skipped_count=stats['skipped'])
+        summary['failed_pages'] = stats['failed_pages']
+        return summary
+
+    def export_page(self, category, page_num, wallpapers):
+        """把一页结果写入导出文件"""
+        if self.exporter is not None and wallpapers:
+            self.exporter.write_page(category, page_num, wallpapers)
+
+    def close_export(self):
+        """关闭导出文件"""
+        if self.exporter is not None:
+            self.exporter.close()
+            self.console.print(f"[green]已导出 {self.exporter.rows} 条记录到 {self.exporter.path}[/green]")
+
+    def build_results_table(self, wallpapers, title):
+        """使用Rich库构建一页结果表格"""
+        from rich.table import Table
+        table = Table(title=title)
         table.add_column("ID", style="cyan", no_wrap=True)
         table.add_column("分辨率", style="magenta")
         table.add_column("大小", style="green")
@@ -489,16 +2937,72 @@ class WallhavenSpider:
                 wp['extension'],
                 wp['download_url']
             )
-
+        return table
+
+    def print_results_summary(self, wallpapers, category):
+        """显示结果摘要：数量、格式分布、常见分辨率和已知的总大小"""
+        from rich.table import Table
+        extensions = {}
+        resolutions = {}
+        known_size = 0
+        for wp in wallpapers:
+            extensions[wp['extension']] = extensions.get(wp['extension'], 0) + 1
+            resolutions[wp['resolution']] = resolutions.get(wp['resolution'], 0) + 1
+            known_size += wp.get('file_size') or 0
+
+        table = Table(title=f"{category.upper()} 类别结果摘要", show_header=False)
+        table.add_column("项目", style="cyan")
+        table.add_column("值", style="green")
+        table.add_row("壁纸数量", str(len(wallpapers)))
+        table.add_row("格式", ", ".join(f"{ext}: {count}" for ext, count in sorted(extensions.items(), key=lambda item: -item[1])))
+        table.add_row("常见分辨率", ", ".join(f"{res} ({count})" for res, count in sorted(resolutions.items(), key=lambda item: -item[1])[:5]))
+        if known_size:
+            table.add_row("总大小", self.format_size(known_size))
+        if self.exporter is not None:
+            table.add_row("导出文件", self.exporter.path)
         self.console.print(table)
-        self.console.print(f"[bold green]共找到 {len(wallpapers)} 个壁纸[/bold green]")
 
-    def download_wallpapers(self, wallpapers, category='misc'):
-        """批量下载壁纸，使用多线程"""
+    def display_results(self, wallpapers, category):
+        """显示结果摘要和壁纸列表，列表每次只渲染一页，结果很多时也不会一次性构建整张表格"""
+        from rich.prompt import Prompt
+        self.print_results_summary(wallpapers, category)
+        page_size = max(1, self.config['result_page_size'])
+        page_count = (len(wallpapers) + page_size - 1) // page_size
+        if page_count == 0:
+            return
+
+        if self.config['result_view'] != 'paged':
+            # 默认只预览第一页
+            self.console.print(self.build_results_table(wallpapers[:page_size], f"前 {min(page_size, len(wallpapers))} 个壁纸"))
+            if page_count > 1:
+                self.console.print(f"[dim]另有 {len(wallpapers) - page_size} 个未显示，将 result_view 设为 paged 可分页查看全部结果[/dim]")
+            return
+
+        for page_index in range(page_count):
+            chunk = wallpapers[page_index * page_size:(page_index + 1) * page_size]
+            self.console.print(self.build_results_table(chunk, f"{category.upper()} 类别壁纸列表 ({page_index + 1}/{page_count})"))
+            if page_index + 1 < page_count:
+                answer = Prompt.ask("回车显示下一页，输入 q 结束浏览", default="")
+                if answer.strip().lower() == 'q':
+                    break
+
+    def download_wallpapers(self, wallpapers, category='misc', on_result=None):
+        """批量下载壁纸，使用多线程，on_result(wallpaper, success) 在每个壁纸下载结束后调用"""
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+        found = len(wallpapers)
+        if found == 0:
+            self.console.print("[yellow]没有壁纸需要下载[/yellow]")
+            return {'total': 0, 'success': 0, 'failed': 0, 'skipped': 0}
+
+        # 一次批量查询索引，过滤掉已下载的壁纸
+        wallpapers = self.filter_known_wallpapers(wallpapers, category)
         total = len(wallpapers)
+        skipped_count = found - total
         if total == 0:
-            self.console.print("[yellow]没有壁纸需要下载[/yellow]")
-            return
+            self.console.print("[bold green]所有壁纸均已下载[/bold green]")
+            return {'total': found, 'success': 0, 'failed': 0, 'skipped': skipped_count}
+        if self.use_async_backend():
+            return self.download_wallpapers_async(wallpapers, category=category, skipped_count=skipped_count, on_result=on_result)
         
         # 从配置中获取最大线程数
         max_threads = min(self.config.get('max_threads', 5), total)
@@ -510,9 +3014,17 @@ class WallhavenSpider:
         # 用于线程安全的锁
         counter_lock = threading.Lock()
         
+        scheduler = self.create_download_scheduler(wallpapers, max_threads)
+
         def download_single_wallpaper(wallpaper):
             nonlocal success_count, failed_count
+            started = time.perf_counter()
             result = self.download_wallpaper(wallpaper['download_url'], wallpaper['id'], wallpaper['extension'], category=category, download_dir=self.config['download_dir'])
+            scheduler.finish(wallpaper, time.perf_counter() - started, result)
+            if result:
+                self.index_downloaded(wallpaper, category)
+            if on_result:
+                on_result(wallpaper, result)
             
             with counter_lock:
                 if result:
@@ -522,33 +3034,385 @@ class WallhavenSpider:
             
             return result
 
-        with Progress(
-                SpinnerColumn(),
-                TextColumn("[progress.description]{task.description}"),
-                BarColumn(),
-                TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
-        ) as progress:
+        with self.create_progress() as progress:
 
             download_task = progress.add_task(description="[cyan]开始下载...", total=total)
             
             # 使用线程池执行器进行多线程下载
             with ThreadPoolExecutor(max_workers=max_threads) as executor:
-                # 提交所有下载任务
-                future_to_wallpaper = {executor.submit(download_single_wallpaper, wp): wp for wp in wallpapers}
-                
-                # 监控下载进度
-                for future in as_completed(future_to_wallpaper):
-                    wallpaper = future_to_wallpaper[future]
-                    progress.update(download_task, advance=1)
+                # 有下载位空出时才向调度器取下一个任务，调度器可以按实测速度调整后续顺序
+                future_to_wallpaper = {}
+                while future_to_wallpaper or len(scheduler):
+                    while len(future_to_wallpaper) < max_threads:
+                        wallpaper = scheduler.next()
+                        if wallpaper is None:
+                            break
+                        future_to_wallpaper[executor.submit(download_single_wallpaper, wallpaper)] = wallpaper
+
+                    # 监控下载进度
+                    done, _ = wait(future_to_wallpaper, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        del future_to_wallpaper[future]
+                        progress.update(download_task, advance=1)
                     # 检查是否被中断
                     if self.interrupted:
                         executor.shutdown(wait=False, cancel_futures=True)
                         raise KeyboardInterrupt("下载被用户中断")
                     
-        self.console.print(f"[bold green]下载完成! 成功: {success_count}, 失败: {failed_count}, 总计: {total}[/bold green]")
+        return self.print_download_summary(success_count, failed_count, found, skipped_count=skipped_count)
+
+    def estimate_download_size(self, wallpaper):
+        """估算壁纸文件大小：优先使用列表数据或 HEAD 得到的大小，否则按分辨率和格式估算"""
+        if wallpaper.get('file_size'):
+            return wallpaper['file_size']
+        res_match = RESOLUTION_PATTERN.search(wallpaper.get('resolution') or '')
+        if not res_match:
+            return 2 * 1024 * 1024
+        # Wallhaven 原图的平均压缩率：PNG 约 1.5 字节/像素，JPG 约 0.4 字节/像素
+        bytes_per_pixel = 1.5 if wallpaper.get('extension') == 'png' else 0.4
+        return int(int(res_match.group(1)) * int(res_match.group(2)) * bytes_per_pixel)
+
+    def probe_download_sizes(self, wallpapers):
+        """用 HEAD 请求获取未知的文件大小，请求经过同一个速率限制器"""
+        from concurrent.futures import ThreadPoolExecutor
+        unknown = [wallpaper for wallpaper in wallpapers if not wallpaper.get('file_size')]
+
+        def probe(wallpaper):
+            try:
+                response = self.request('HEAD', wallpaper['download_url'], allow_redirects=True)
+            except requests.exceptions.RequestException:
+                return
+            content_length = response.headers.get('Content-Length')
+            if response.status_code == 200 and content_length and content_length.isdigit():
+                wallpaper['file_size'] = int(content_length)
+
+        with ThreadPoolExecutor(max_workers=max(1, self.config.get('max_threads', 5))) as executor:
+            list(executor.map(probe, unknown))
+
+    def create_download_scheduler(self, wallpapers, workers):
+        """按配置的下载顺序策略创建下载调度器"""
+        policy = self.config['download_order']
+        if policy != 'listing' and self.config['probe_sizes']:
+            self.probe_download_sizes(wallpapers)
+        return DownloadScheduler(wallpapers, self.estimate_download_size, policy, workers, self.config['large_file_seconds'])
+
+    def use_async_backend(self):
+        """判断是否使用 asyncio 后端，未安装 aiohttp 时回退到线程后端"""
+        if self.config['io_backend'] != 'async':
+            return False
+        if load_async_backend() is None:
+            if not self._async_fallback_warned:
+                self.console.print("[yellow]未安装 aiohttp，回退到线程后端 (pip install aiohttp)[/yellow]")
+                self._async_fallback_warned = True
+            return False
+        return True
+
+    def create_async_session(self):
+        """创建带有显式连接池大小和 keep-alive 的 aiohttp 会话"""
+        connector = aiohttp.TCPConnector(
+            limit=self.config['async_pool_size'],
+            limit_per_host=self.config['async_pool_size'],
+            keepalive_timeout=60,
+        )
+        # 与 requests 后端一致，只限制建立连接和每次读取的等待时间，不限制整个传输，
+        # 否则大文件、慢速链路或带宽限制下的下载会在传输途中超时
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.config['timeout'], sock_read=self.config['timeout'])
+        return aiohttp.ClientSession(connector=connector, timeout=timeout, headers=dict(self.session.headers))
+
+    async def request_async(self, session, method, url, **kwargs):
+        """异步请求的统一入口，与线程后端共享速率限制器和退避重试策略"""
+        limiter = self.limiter_for(url)
+        max_retries = self.config['max_retries']
+
+        host = urlparse(url).netloc
+        for attempt in range(max_retries + 1):
+            await asyncio.sleep(limiter.reserve())
+            try:
+                with self.metrics.timer('request_seconds', method=method, host=host):
+                    response = await session.request(method, url, **kwargs)
+                self.metrics.inc('responses', status=response.status)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= max_retries:
+                    raise
+                self.count_stat('retries')
+                await asyncio.sleep(self.backoff_delay(attempt))
+                continue
+
+            if response.status not in RETRY_STATUS_CODES or attempt >= max_retries:
+                if response.status == 429:
+                    limiter.on_throttle(self.parse_retry_after(response.headers.get('Retry-After')))
+                    self.count_stat('throttled')
+                elif response.status < 400:
+                    limiter.on_success()
+                return response
+
+            response.release()
+            self.count_stat('retries')
+            if response.status == 429:
+                # 限流时全局暂停，由速率限制器在下一次预约时间片时等待
+                self.count_stat('throttled')
+                retry_after = self.parse_retry_after(response.headers.get('Retry-After'))
+                limiter.on_throttle(retry_after)
+                if retry_after is None:
+                    await asyncio.sleep(self.backoff_delay(attempt))
+            else:
+                await asyncio.sleep(self.backoff_delay(attempt))
+
+    async def fetch_parsed_async(self, session, url, params, cache_category, parse):
+        """异步获取并解析页面，缓存策略与 fetch_parsed 相同"""
+        ttl = self.cache_ttl(cache_category, params)
+        entry = None
+        headers = {}
+        if self.cache is not None and ttl > 0:
+            key = ResponseCache.make_key(url, params)
+            entry = self.cache.get(key)
+            if entry is not None and time.time() - entry['stored_at'] < ttl:
+                self.count_cache_hit(entry)
+                return entry['parsed']
+            if entry is not None:
+                if entry['etag']:
+                    headers['If-None-Match'] = entry['etag']
+                if entry['last_modified']:
+                    headers['If-Modified-Since'] = entry['last_modified']
+
+        phase = self.metrics_phase(cache_category)
+        with self.metrics.timer('fetch_seconds', phase=phase):
+            response = await self.request_async(session, 'GET', url, params=params, headers=headers)
+            async with response:
+                if response.status == 304 and entry is not None:
+                    self.cache.refresh(key)
+                    self.count_cache_hit(entry)
+                    return entry['parsed']
+                response.raise_for_status()
+                body = await response.read()
+                text = body.decode(response.get_encoding())
+
+        with self.metrics.timer('parse_seconds', phase=phase):
+            parsed = parse(text)
+        if self.cache is not None and ttl > 0:
+            self.count_stat('cache_misses')
+            if parsed:
+                self.cache.put(key, response.headers.get('ETag'), response.headers.get('Last-Modified'), len(body), parsed)
+        return parsed
+
+    async def get_wallpapers_from_page_async(self, session, semaphore, category, page_num, params=None, raise_errors=False):
+        """异步获取指定列表页的壁纸列表"""
+        url, params, parse = self.build_page_request(category, page_num, params)
+
+        async with semaphore:
+            try:
+                return self.as_wallpapers(await self.fetch_parsed_async(session, url, params, category, parse))
+            except Exception as e:
+                self.console.print(f"[red]获取页面 {page_num} 的壁纸时出错: {str(e)}[/red]")
+                if raise_errors:
+                    raise
+                return []
+
+    def fetch_pages_async(self, category, page_numbers, params=None, on_page_done=None):
+        """在单个事件循环中并发获取多个列表页，按页码顺序返回"""
+
+        async def fetch_all():
+            semaphore = asyncio.Semaphore(max(1, self.config['max_page_workers']))
+            async with self.create_async_session() as session:
+
+                async def fetch(page_num):
+                    try:
+                        wallpapers = await self.get_wallpapers_from_page_async(session, semaphore, category, page_num, params, raise_errors=True)
+                        # 详情页由详情线程池并发请求，等待时不阻塞事件循环
+                        await asyncio.to_thread(self.enrich_wallpapers, wallpapers)
+                    except Exception:
+                        wallpapers = None
+                    if on_page_done:
+                        on_page_done(page_num, wallpapers)
+                    return wallpapers or []
+
+                return await asyncio.gather(*(fetch(page_num) for page_num in page_numbers))
+
+        return list(asyncio.run(fetch_all()))
+
+    async def download_to_part_file_async(self, session, download_url, part_path, verifier=None):
+        """异步下载到 .part 临时文件，已有部分内容时使用 Range 请求续传，verifier 在写入时同步计算哈希"""
+        resume_from = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if verifier is not None:
+            verifier.resume(part_path, resume_from)
+        headers = {'Range': f'bytes={resume_from}-'} if resume_from else None
+
+        response = await self.request_async(session, 'GET', download_url, headers=headers)
+        async with response:
+            if response.status == 416:
+                # 临时文件与服务器上的文件不一致，丢弃后重新下载
+                os.remove(part_path)
+                raise IncompleteDownloadError("临时文件无效，重新下载")
+            response.raise_for_status()
+
+            # 服务器不支持 Range 时返回完整文件，需要从头写入
+            mode = 'ab' if response.status == 206 else 'wb'
+            if mode == 'wb' and verifier is not None:
+                verifier.reset()
+            expected_size = self.expected_download_size(response.status, response.headers, resume_from)
+
+            write_seconds = 0.0
+            writer = None
+            try:
+                with self.open_part_file(part_path, mode, expected_size) as writer:
+                    # aiohttp 不支持 readinto，按缓冲区大小分块读取以减少循环次数
+                    async for chunk in response.content.iter_chunked(self.read_size()):
+                        if self.bandwidth is not None:
+                            await asyncio.sleep(self.bandwidth.reserve(len(chunk)))
+                        started = time.perf_counter()
+                        writer.write(chunk)
+                        write_seconds += time.perf_counter() - started
+                        if verifier is not None:
+                            verifier.update(chunk)
+                        # 检查是否被中断
+                        if self.interrupted:
+                            raise KeyboardInterrupt("下载被用户中断")
+            finally:
+                self.record_write_metrics(writer, write_seconds)
+
+        actual_size = os.path.getsize(part_path)
+        if expected_size is not None and actual_size != expected_size:
+            raise IncompleteDownloadError(f"下载不完整: {actual_size}/{expected_size} 字节")
+
+    async def download_file_async(self, session, download_url, filepath):
+        """异步下载文件到 .part 临时文件，中断时断点续传，校验完整后原子重命名，返回 (最终路径, SHA-256)"""
+        part_path = filepath + '.part'
+        verifier = StreamVerifier()
+        max_retries = self.config['max_retries']
+        for attempt in range(max_retries + 1):
+            try:
+                await self.download_to_part_file_async(session, download_url, part_path, verifier)
+                self.verify_download(part_path, verifier)
+                break
+            except aiohttp.ClientResponseError:
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError, IncompleteDownloadError) as e:
+                # 连接中断时保留临时文件，退避后从断点续传
+                if attempt >= max_retries:
+                    raise
+                self.count_stat('retries')
+                self.console.print(f"[yellow]下载中断，准备续传 ({attempt + 1}/{max_retries}) {download_url}: {str(e)}[/yellow]")
+                # 在事件循环中等待，不阻塞其他正在进行的下载
+                await asyncio.sleep(self.backoff_delay(attempt))
+
+        return self.finish_download(part_path, filepath, verifier)
+
+    async def resolve_extension_async(self, session, wallpaper_id, failed_extension):
+        """异步用 HEAD 请求探测正确的扩展名，最后才访问详情页"""
+        for extension in self.alternate_extensions(failed_extension):
+            download_url = self.build_download_url(wallpaper_id, extension)
+            try:
+                response = await self.request_async(session, 'HEAD', download_url, allow_redirects=True)
+                async with response:
+                    status = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                continue
+            if status == 200:
+                self.extension_cache[wallpaper_id] = extension
+                self.count_stat('extension_fixed')
+                return extension, download_url
+            self.count_stat('wasted_requests')
+
+        # 详情页请求较慢，只作为最后手段，在线程池中执行避免阻塞事件循环
+        details = await asyncio.wrap_future(self.submit_details(wallpaper_id))
+        if details:
+            self.extension_cache[wallpaper_id] = details['extension']
+            self.count_stat('extension_fixed')
+            return details['extension'], details['download_url']
+        return None
+
+    async def download_wallpaper_async(self, session, semaphore, download_url, wallpaper_id, extension, category='misc', download_dir='downloads'):
+        """异步下载单个壁纸，扩展名猜错导致404时自动改用正确的扩展名"""
+        try:
+            # 已确认过扩展名的壁纸直接使用正确的下载链接
+            confirmed = self.extension_cache.get(wallpaper_id)
+            if confirmed and confirmed != extension:
+                extension = confirmed
+                download_url = self.build_download_url(wallpaper_id, extension)
+
+            filepath = self.build_filepath(wallpaper_id, extension, category, download_dir)
+
+            # 检查文件是否已存在，只有完整下载的文件才会使用最终文件名
+            if os.path.exists(filepath):
+                self.console.print(f"[yellow]文件已存在，跳过: {filepath}[/yellow]")
+                return True
+
+            async with semaphore:
+                try:
+                    with self.metrics.timer('download_seconds'):
+                        filepath, digest = await self.download_file_async(session, download_url, filepath)
+                except aiohttp.ClientResponseError as e:
+                    if e.status != 404:
+                        raise
+                    self.count_stat('wasted_requests')
+                    resolved = await self.resolve_extension_async(session, wallpaper_id, extension)
+                    if resolved is None:
+                        raise
+                    extension, download_url = resolved
+                    filepath = self.build_filepath(wallpaper_id, extension, category, download_dir)
+                    digest = None
+                    if not os.path.exists(filepath):
+                        with self.metrics.timer('download_seconds'):
+                            filepath, digest = await self.download_file_async(session, download_url, filepath)
+
+            # 文件头校验可能按实际格式修正了扩展名
+            extension = os.path.splitext(filepath)[1][1:]
+            # 哈希只在写入索引时使用，不使用索引时不保存，避免长时间运行时不断累积
+            if digest and self.config['use_index']:
+                self.file_hashes[wallpaper_id] = digest
+            self.extension_cache[wallpaper_id] = extension
+            self.console.print(f"[green]下载完成: {filepath}[/green]")
+            return True
+        except KeyboardInterrupt:
+            raise
+        except Exception as e:
+            self.console.print(f"[red]下载失败 {download_url}: {str(e)}[/red]")
+            return False
+
+    def download_wallpapers_async(self, wallpapers, category='misc', skipped_count=0, on_result=None):
+        """批量下载壁纸，使用单个事件循环和并发信号量"""
+        total = len(wallpapers)
+        results = []
+
+        concurrency = max(1, self.config['async_concurrency'])
+        scheduler = self.create_download_scheduler(wallpapers, min(concurrency, total))
+
+        async def download_all(progress, download_task):
+            semaphore = asyncio.Semaphore(concurrency)
+            async with self.create_async_session() as session:
+
+                async def download_worker():
+                    # 每个协程下载完一个再向调度器取下一个，与线程后端使用相同的下载顺序
+                    worker_results = []
+                    while True:
+                        wallpaper = scheduler.next()
+                        if wallpaper is None:
+                            return worker_results
+                        started = time.perf_counter()
+                        result = await self.download_wallpaper_async(session, semaphore, wallpaper['download_url'], wallpaper['id'], wallpaper['extension'], category=category, download_dir=self.config['download_dir'])
+                        scheduler.finish(wallpaper, time.perf_counter() - started, result)
+                        if result:
+                            self.index_downloaded(wallpaper, category)
+                        if on_result:
+                            on_result(wallpaper, result)
+                        progress.update(download_task, advance=1)
+                        worker_results.append(result)
+
+                worker_results = await asyncio.gather(*(download_worker() for _ in range(min(concurrency, total))))
+                return [result for results in worker_results for result in results]
+
+        with self.create_progress() as progress:
+
+            download_task = progress.add_task(description="[cyan]开始下载...", total=total)
+            results = asyncio.run(download_all(progress, download_task))
+
+        success_count = sum(1 for result in results if result)
+        failed_count = total - success_count
+        return self.print_download_summary(success_count, failed_count, total + skipped_count, skipped_count=skipped_count)
 
     def run(self):
         """运行爬虫"""
+        from rich.prompt import Prompt
         self.console.print("[bold green]Wallhaven 爬虫程序启动![/bold green]")
 
         while True:
@@ -576,18 +3440,467 @@ class WallhavenSpider:
                     break
                 else:
                     self.console.print("[red]无效选择，请重新输入[/red]")
+                self.write_metrics()
             except KeyboardInterrupt:
                 self.console.print("\n[yellow]检测到中断信号，正在退出程序...[/yellow]")
+                self.write_metrics()
                 break
+        self.close_export()
+
+
+TIME_RANGES = ['all', '1d', '3d', '1w', '1M', '3M', '6M', '1y']
+CATEGORIES = ['tag', 'toplist', 'random', 'latest']
+
+
+def parse_pages(spec):
+    """解析页码范围，支持 "3"、"1-5" 和 "1,3,7-9" 等写法"""
+    pages = []
+    for part in str(spec).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            start, end = int(start), int(end)
+            if start < 1 or end < start:
+                raise ValueError(f"无效的页码范围: {part}")
+            pages.extend(range(start, end + 1))
+        else:
+            page = int(part)
+            if page < 1:
+                raise ValueError(f"无效的页码: {part}")
+            pages.append(page)
+    if not pages:
+        raise ValueError("页码范围不能为空")
+    return pages
+
+
+def load_jobs(args):
+    """从命令行参数或任务文件中读取爬取任务列表"""
+    jobs = []
+    if args.job_file:
+        with open(args.job_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        jobs.extend(data['jobs'] if isinstance(data, dict) else data)
+    if args.category:
+        jobs.append({
+            'category': args.category,
+            'tag': args.tag,
+            'range': args.range,
+            'resolution': args.resolution,
+            'pages': args.pages,
+            'output': args.output,
+        })
 
+    for job in jobs:
+        if job.get('category') not in CATEGORIES:
+            raise ValueError(f"无效的类别: {job.get('category')}")
+        if job['category'] == 'tag' and not job.get('tag'):
+            raise ValueError("tag 类别需要指定标签")
+        if job.get('range', 'all') not in TIME_RANGES:
+            raise ValueError(f"无效的时间范围: {job.get('range')}")
+        job['pages'] = parse_pages(job.get('pages', '1'))
+    return jobs
+
+
+def build_arg_parser():
+    """构建命令行参数解析器"""
+    parser = argparse.ArgumentParser(description="Wallhaven 壁纸爬虫，不带任务参数时进入交互模式")
+    parser.add_argument('--config', help="配置文件路径，默认为 $WALLHAVEN_PATH/config.json")
+    parser.add_argument('--category', choices=CATEGORIES, help="爬取类别")
+    parser.add_argument('--tag', help="标签名称 (tag 类别必填)")
+    parser.add_argument('--range', default='all', choices=TIME_RANGES, help="时间范围筛选")
+    parser.add_argument('--resolution', help="分辨率筛选，如 1920x1080")
+    parser.add_argument('--pages', default='1', help="页码范围，如 3、1-5、1,3,7-9")
+    parser.add_argument('--output', help="下载目录，覆盖配置文件中的 download_dir")
+    parser.add_argument('--job-file', help="任务文件 (JSON)，包含多个爬取任务")
+    parser.add_argument('--threads', type=int, help="最大下载线程数")
+    parser.add_argument('--page-workers', type=int, help="并发获取列表页的线程数")
+    parser.add_argument('--backend', choices=['thread', 'async'], help="网络后端")
+    parser.add_argument('--listing-backend', choices=['html', 'api'], help="列表数据来源")
+    parser.add_argument('--stream', action='store_true', help="流式模式，边解析列表页边下载")
+    parser.add_argument('--no-download', action='store_true', help="只获取列表，不下载")
+    parser.add_argument('--status-file', help="把运行结果 (JSON) 额外写入该文件")
+    parser.add_argument('--metrics-file', help="运行结束时写入性能指标，.prom 后缀为 Prometheus 文本格式，其他为 JSON")
+    parser.add_argument('--details', help=f"通过详情页补全的字段，逗号分隔 ({', '.join(DETAIL_FIELDS)})，列表页信息已足够时跳过")
+    parser.add_argument('--export', help="把列表结果逐页导出到文件，格式由后缀决定 (.jsonl / .csv / .parquet)")
+    parser.add_argument('--max-rps', type=float, help="每个主机每秒最大请求数，覆盖 max_requests_per_second")
+    parser.add_argument('--queue', help="分布式模式的共享工作队列 (SQLite 文件)，带任务参数时登记任务并汇总进度")
+    parser.add_argument('--workers', type=int, default=0, help="分布式模式下在本机启动的工作进程数，默认 0 (只登记任务并等待其他工作进程)")
+    parser.add_argument('--worker', action='store_true', help="作为工作进程运行，从 --queue 指定的队列中领取任务")
+    parser.add_argument('--watch', action='store_true', help="同步模式：按间隔轮询 latest 或标签搜索，遇到上次见过的壁纸就停止翻页，只下载新壁纸")
+    parser.add_argument('--interval', type=float, help="同步模式的轮询间隔 (秒)，覆盖 watch_interval")
+    parser.add_argument('--cycles', type=int, default=0, help="同步模式运行的轮数，默认 0 (一直运行直到中断)")
+    parser.add_argument('--plain', action='store_true', help="纯文本输出，不显示进度条也不加载 rich，适合定时任务和日志文件 (交互模式不支持)")
+    return parser
+
+
+def create_batch_spider(args):
+    """创建非交互模式使用的爬虫，用命令行参数覆盖配置"""
+    # 进度和日志输出到 stderr，stdout 只输出机器可读的运行结果
+    spider = WallhavenSpider(args.config, console=create_console(args.plain, stderr=True))
+    overrides = {
+        'max_threads': args.threads,
+        'max_page_workers': args.page_workers,
+        'io_backend': args.backend,
+        'listing_backend': args.listing_backend,
+        'metrics_file': args.metrics_file,
+        'max_requests_per_second': args.max_rps,
+    }
+    spider.config.update({key: value for key, value in overrides.items() if value is not None})
+    if args.stream:
+        spider.config['stream_downloads'] = True
+    if args.details:
+        spider.config['detail_fields'] = [field.strip() for field in args.details.split(',') if field.strip()]
+    unknown_fields = set(spider.config['detail_fields']) - set(DETAIL_FIELDS)
+    if unknown_fields:
+        raise ValueError(f"无效的详情字段: {', '.join(sorted(unknown_fields))} (可选: {', '.join(DETAIL_FIELDS)})")
+    if args.export:
+        spider.exporter = ResultExporter(args.export)
+    return spider
+
+
+def job_status(stats):
+    """根据任务统计判断任务状态，下载失败或有列表页获取失败都视为失败"""
+    return 'ok' if stats.get('failed', 0) == 0 and stats.get('failed_pages', 0) == 0 else 'failed'
+
+
+def write_status(args, status):
+    """把运行结果以 JSON 输出到 stdout，并按需写入状态文件"""
+    output = json.dumps(status, ensure_ascii=False)
+    print(output)
+    if args.status_file:
+        with open(args.status_file, 'w', encoding='utf-8') as f:
+            f.write(output)
+
+
+def run_batch(args):
+    """批处理模式：依次执行所有任务，共享同一个连接池和速率限制器，返回退出码"""
+    try:
+        jobs = load_jobs(args)
+    except (OSError, ValueError, KeyError) as e:
+        print(json.dumps({'status': 'error', 'error': str(e)}, ensure_ascii=False))
+        return 2
 
-if __name__ == "__main__":
     try:
+        spider = create_batch_spider(args)
+    except ValueError as e:
+        print(json.dumps({'status': 'error', 'error': str(e)}, ensure_ascii=False))
+        return 2
+    if args.queue:
+        return run_distributed(args, jobs, spider)
+    if args.watch:
+        return run_watch(args, jobs, spider)
+    default_output = spider.config['download_dir']
+
+    results = []
+    exit_code = 0
+    for job in jobs:
+        spider.config['download_dir'] = job.get('output') or default_output
+        started = time.time()
+        result = {key: job.get(key) for key in ('category', 'tag', 'range', 'resolution', 'output')}
+        result['pages'] = [job['pages'][0], job['pages'][-1]]
+        try:
+            stats = spider.run_job(job['category'], job['pages'], tag=job.get('tag'), time_range=job.get('range') or 'all',
+                                   resolution=job.get('resolution'), download=not args.no_download)
+            result.update(stats)
+            result['status'] = job_status(stats)
+        except KeyboardInterrupt:
+            result['status'] = 'interrupted'
+        except Exception as e:
+            result.update(status='error', error=str(e))
+        result['elapsed'] = round(time.time() - started, 3)
+        results.append(result)
+
+        if result['status'] != 'ok':
+            exit_code = 1
+        if result['status'] == 'interrupted':
+            exit_code = 130
+            break
+
+    status = {'status': 'ok' if exit_code == 0 else 'failed', 'jobs': results}
+    spider.write_metrics()
+    spider.close_export()
+    write_status(args, status)
+    return exit_code
+
+
+def run_watch(args, jobs, spider):
+    """同步模式：每轮依次同步所有任务，每轮结束后输出一行 JSON 状态，被中断时退出"""
+    invalid = [job['category'] for job in jobs if job['category'] not in WATCH_CATEGORIES]
+    if invalid:
+        print(json.dumps({'status': 'error', 'error': f"同步模式只支持 {', '.join(WATCH_CATEGORIES)} 类别: {', '.join(invalid)}"}, ensure_ascii=False))
+        return 2
+    interval = args.interval if args.interval is not None else spider.config['watch_interval']
+    default_output = spider.config['download_dir']
+
+    cycle = 0
+    exit_code = 0
+    try:
+        while True:
+            cycle += 1
+            results = []
+            for job in jobs:
+                spider.config['download_dir'] = job.get('output') or default_output
+                started = time.time()
+                result = {key: job.get(key) for key in ('category', 'tag', 'resolution', 'output')}
+                try:
+                    result.update(spider.sync_query(job['category'], tag=job.get('tag'), resolution=job.get('resolution'),
+                                                    download=not args.no_download))
+                    result['status'] = job_status(result)
+                except KeyboardInterrupt:
+                    raise
+                except Exception as e:
+                    # 单轮失败不影响之后的轮次，高水位标记没有更新，下一轮会重新同步
+                    result.update(status='error', error=str(e))
+                result['elapsed'] = round(time.time() - started, 3)
+                results.append(result)
+
+            exit_code = 0 if all(result['status'] == 'ok' for result in results) else 1
+            spider.write_metrics()
+            write_status(args, {'status': 'ok' if exit_code == 0 else 'failed', 'cycle': cycle, 'jobs': results})
+            if args.cycles and cycle >= args.cycles:
+                break
+            spider.console.print(f"[cyan]{interval:g} 秒后开始下一轮同步...[/cyan]")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        spider.console.print("[yellow]同步已停止[/yellow]")
+        exit_code = 130
+    finally:
+        spider.close_export()
+    return exit_code
+
+
+def worker_command(args, max_rps):
+    """启动本机工作进程的命令行，打包为可执行文件时直接调用自身"""
+    command = [sys.executable] if getattr(sys, 'frozen', False) else [sys.executable, os.path.abspath(__file__)]
+    command += ['--worker', '--queue', args.queue, '--max-rps', str(max_rps)]
+    if args.config:
+        command += ['--config', args.config]
+    if args.plain:
+        command.append('--plain')
+    for flag, value in (('--threads', args.threads), ('--page-workers', args.page_workers), ('--backend', args.backend)):
+        if value is not None:
+            command += [flag, str(value)]
+    return command
+
+
+def run_distributed(args, jobs, spider):
+    """分布式模式：把任务登记到共享队列，按需在本机启动工作进程，并汇总各工作进程上报的进度"""
+    import subprocess
+    work_queue = WorkQueue(args.queue, spider.config['queue_lease_seconds'], spider.config['queue_max_attempts'])
+    job_keys = []
+    for job in jobs:
+        params = spider.build_search_params(job['category'], job.get('tag'), job.get('range') or 'all', job.get('resolution'))
+        key = spider.job_key(job['category'], params)
+        work_queue.add_job(key, job['category'], params, spider.config['listing_backend'], job.get('output'), not args.no_download, job['pages'])
+        job_keys.append(key)
+
+    # 本机的多个工作进程共用同一个出口 IP，平分请求速率预算
+    processes = []
+    if args.workers > 0:
+        max_rps = spider.config['max_requests_per_second'] / args.workers
+        log_prefix = os.path.splitext(args.queue)[0]
+        for i in range(args.workers):
+            with open(f"{log_prefix}.worker{i}.log", 'a', encoding='utf-8') as log:
+                processes.append(subprocess.Popen(worker_command(args, max_rps), stdout=subprocess.DEVNULL, stderr=log))
+    spider.console.print(f"[bold blue]已登记 {len(job_keys)} 个任务到队列 {args.queue}，本机工作进程 {len(processes)} 个[/bold blue]")
+
+    def totals():
+        pages = {}
+        downloads = {}
+        for key in job_keys:
+            summary = work_queue.summary(key)
+            for status, count in summary['page'].items():
+                pages[status] = pages.get(status, 0) + count
+            for status, count in summary['download'].items():
+                downloads[status] = downloads.get(status, 0) + count
+        return pages, downloads
+
+    exit_code = 0
+    try:
+        with spider.create_progress(counter='count') as progress:
+            page_task = progress.add_task(description="[cyan]列表页", total=None)
+            download_task = progress.add_task(description="[cyan]下载", total=None)
+            while True:
+                pages, downloads = totals()
+                active = sum(1 for worker in work_queue.workers() if worker['status'] == 'running')
+                progress.update(page_task, total=sum(pages.values()), completed=pages.get('done', 0) + pages.get('failed', 0),
+                                description=f"[cyan]列表页 (活动工作进程 {active} 个)")
+                progress.update(download_task, total=sum(downloads.values()), completed=downloads.get('done', 0) + downloads.get('failed', 0))
+                if not work_queue.has_unfinished(job_keys):
+                    break
+                if processes and all(process.poll() is not None for process in processes) and not active:
+                    # 本机工作进程全部异常退出，且没有其他工作进程在处理
+                    spider.console.print("[red]所有工作进程已退出，但队列中仍有未完成的任务[/red]")
+                    exit_code = 1
+                    break
+                time.sleep(1)
+    except KeyboardInterrupt:
+        exit_code = 130
+    finally:
+        # 队列完成后工作进程会自行退出，给它们一点时间，其余的发送中断信号
+        grace_deadline = time.time() + (10 if exit_code == 0 else 0)
+        for process in processes:
+            try:
+                process.wait(timeout=max(0.0, grace_deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                pass
+            if process.poll() is None:
+                # 让工作进程把持有的任务放回队列后再退出
+                if os.name == 'nt':
+                    process.terminate()
+                else:
+                    process.send_signal(signal.SIGINT)
+        for process in processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    results = []
+    for job, key in zip(jobs, job_keys):
+        summary = work_queue.summary(key)
+        result = {name: job.get(name) for name in ('category', 'tag', 'range', 'resolution', 'output')}
+        result['pages'] = summary['page']
+        result['downloads'] = summary['download']
+        result['failed_pages'] = summary['page'].get('failed', 0)
+        failed = result['failed_pages'] + summary['download'].get('failed', 0)
+        unfinished = any(summary[kind].get(status) for kind in summary for status in ('pending', 'claimed'))
+        result['status'] = 'interrupted' if exit_code == 130 and unfinished else ('ok' if not failed and not unfinished else 'failed')
+        results.append(result)
+        if result['status'] == 'failed' and exit_code == 0:
+            exit_code = 1
+
+    status = {'status': 'ok' if exit_code == 0 else 'failed', 'jobs': results, 'workers': work_queue.workers()}
+    work_queue.close()
+    write_status(args, status)
+    return exit_code
+
+
+def run_queue_worker(args):
+    """工作进程：从共享队列中领取列表页和下载任务，直到队列中没有未完成的任务"""
+    spider = create_batch_spider(args)
+    if spider.exporter is not None:
+        # 多个工作进程各自写入带进程号的导出文件
+        root, extension = os.path.splitext(spider.exporter.path)
+        spider.exporter = ResultExporter(f"{root}.{os.getpid()}{extension}")
+    work_queue = WorkQueue(args.queue, spider.config['queue_lease_seconds'], spider.config['queue_max_attempts'])
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    default_output = spider.config['download_dir']
+    default_backend = spider.config['listing_backend']
+    page_batch = max(1, spider.config['max_page_workers'])
+    download_batch = max(1, spider.config.get('max_threads', 5)) * 4
+
+    progress = {'host': socket.gethostname(), 'pid': os.getpid(), 'status': 'running', 'started_at': time.time(),
+                'pages_done': 0, 'pages_failed': 0, 'downloads_done': 0, 'downloads_failed': 0, 'downloaded_bytes': 0}
+    progress_lock = threading.Lock()
+    stop_event = threading.Event()
+
+    def report():
+        with progress_lock:
+            progress['downloaded_bytes'] = sum(value for (name, _), value in spider.metrics.counters.items() if name == 'downloaded_bytes')
+            snapshot = dict(progress)
+        work_queue.heartbeat(worker_id, snapshot)
+
+    def heartbeat():
+        # 定期续租并上报进度，间隔为租约时长的三分之一
+        while not stop_event.wait(max(1.0, work_queue.lease_seconds / 3)):
+            report()
+
+    def count(key):
+        with progress_lock:
+            progress[key] += 1
+
+    def process_pages(job, info, keys):
+        def on_page_done(page_num, wallpapers):
+            if wallpapers is None:
+                work_queue.record_result(job, 'page', page_num, False)
+                count('pages_failed')
+                return
+            work_queue.record_page(job, page_num, wallpapers if info['download'] else [])
+            count('pages_done')
+
+        spider.fetch_pages(info['category'], [int(key) for key in keys], info['params'], on_page_done=on_page_done)
+
+    def process_downloads(job, info, payloads):
+        reported = set()
+
+        def on_result(wallpaper, success):
+            reported.add(wallpaper['id'])
+            work_queue.record_result(job, 'download', wallpaper['id'], success)
+            count('downloads_done' if success else 'downloads_failed')
+
+        wallpapers = spider.as_wallpapers(json.loads(payload) for payload in payloads)
+        spider.download_wallpapers(wallpapers, category=info['category'], on_result=on_result)
+        # 索引中已存在而被跳过的壁纸视为已完成
+        for wallpaper in wallpapers:
+            if wallpaper['id'] not in reported:
+                work_queue.record_result(job, 'download', wallpaper['id'], True)
+                count('downloads_done')
+
+    report()
+    threading.Thread(target=heartbeat, daemon=True).start()
+    exit_code = 0
+    try:
+        while True:
+            kind, items = work_queue.claim(worker_id, page_batch, download_batch)
+            if not items:
+                if not work_queue.has_unfinished():
+                    break
+                # 其他工作进程还在处理列表页，稍后可能产生新的下载任务
+                time.sleep(1)
+                continue
+
+            by_job = {}
+            for job, key, payload in items:
+                by_job.setdefault(job, []).append(payload if kind == 'download' else key)
+            for job, values in by_job.items():
+                info = work_queue.job_info(job)
+                spider.config['download_dir'] = info['output'] or default_output
+                spider.config['listing_backend'] = info['listing_backend'] or default_backend
+                if kind == 'page':
+                    process_pages(job, info, values)
+                else:
+                    process_downloads(job, info, values)
+            spider.release_details()
+        progress['status'] = 'finished'
+    except KeyboardInterrupt:
+        work_queue.release(worker_id)
+        progress['status'] = 'interrupted'
+        exit_code = 130
+    finally:
+        stop_event.set()
+        report()
+        work_queue.close()
+        spider.close_export()
+    return exit_code
+
+
+def main(argv=None):
+    """程序入口：有任务参数时运行批处理模式，否则进入交互模式"""
+    args = build_arg_parser().parse_args(argv)
+    if not args.config:
         # 配置文件位置在$WALLHAVEN_PATH/config.json
-        config_file = os.environ.get('WALLHAVEN_PATH', '.') + '/config.json'
-        spider = WallhavenSpider(config_file)
+        args.config = os.environ.get('WALLHAVEN_PATH', '.') + '/config.json'
+
+    if args.worker:
+        if not args.queue:
+            print(json.dumps({'status': 'error', 'error': "--worker 需要同时指定 --queue"}, ensure_ascii=False))
+            return 2
+        return run_queue_worker(args)
+    if args.category or args.job_file:
+        return run_batch(args)
+
+    try:
+        spider = WallhavenSpider(args.config)
         spider.run()
     except KeyboardInterrupt:
         print("\n程序被用户中断")
     except Exception as e:
-        print(f"程序出现异常: {e}")
\ No newline at end of file
+        print(f"程序出现异常: {e}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())